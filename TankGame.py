@@ -1,141 +1,351 @@
+import io
 import os
+import time
 import pygame
-import math
-import tmx
-from pygame.math import Vector2
-from gamestate import GameState
-from layer import ArrayLayer, UnitsLayer, BulletsLayer, ExplosionsLayer
-from command import MoveCommand, TargetCommand, ShootCommand, MoveBulletCommand, DeleteDestroyedCommand, LoadLevelCommand
+import argparse
+from command import LoadLevelCommand
 from gamemode import *
+from replay import Recorder, ReplayReader, ReplayPlayGameMode
+from loader import MusicLoader, LevelLoader
+from network import GameClient, ClientPlayGameMode
+from assets import assets
+from profiler import profiler, ProfilerOverlay
 
 os.environ['SDL_VIDEO_CENTERED'] = '1'
 
+# Musics
+menuMusic = "17718_1462204250.ogg"
+levelMusic = "17687_1462199612.ogg"
+gameWonMusic = "17382_1461858477.ogg"
+gameLostMusic = "17675_1462199580.ogg"
+
 class UserInterface():
-    def __init__(self):
+    """
+    Window and main loop.
+
+    The game state is updated at a fixed rate (simulationRate epochs per second),
+    whatever the frame rate: each frame runs the epochs of the elapsed time, up 
+    to maxCatchUpSteps (the game slows down instead of running more and more 
+    epochs per frame), and units and bullets are drawn between their last two
+    positions. With dirtyRects, only the changed parts of the game view are 
+    sent to the display (see PlayGameMode.render).
+    """
+    def __init__(self, recordFile=None, simulationRate=60, frameRate=60, maxCatchUpSteps=5, dirtyRects=True):
         # Window
         pygame.init()
-        self.window = pygame.display.set_mode((1280, 720))
+        self.maxWindowSize = (1280, 720)
+        self.window = pygame.display.set_mode(self.maxWindowSize)
         pygame.display.set_caption("Discover Python & Patterns - https://www.patternsgameprog.com")
         pygame.display.set_icon(pygame.image.load("icon.png"))
         
-        # Modes
+        # Recording of the player's inputs (see replay module)
+        self.recordFile = recordFile
+        self.recorder = None
+
+        # Modes (levels and replays are loaded in the background, see loader module)
         self.playGameMode = None
-        self.overlayGameMode = MenuGameMode()
-        self.overlayGameMode.addObserver(self)
-        self.currentActiveMode = 'Overlay'
+        self.overlayGameMode = None
+        self.pendingReplayFileName = None
+        self.overlaySurface = None
+        self.overlaySurfaceMode = None
+        self.pausedFrame = None
+        self.overlayFrame = None
+        self.showOverlay(MenuGameMode())
         
-        # Music
-        pygame.mixer.music.load("17718_1462204250.ogg")
-        pygame.mixer.music.play(loops=-1)
+        # Music (the other musics are read in the background)
+        self.musicFile = None
+        self.musicLoader = MusicLoader([ gameWonMusic, gameLostMusic ]).start()
+        self.playMusic(menuMusic)
 
-        # Loop properties
+        # Timings overlay (F3 during the game)
+        self.profilerOverlay = ProfilerOverlay(profiler)
+
+        # Loop properties (a frame rate of 0 means no limit)
         self.clock = pygame.time.Clock()
+        self.simulationRate = simulationRate
+        self.frameRate = frameRate
+        self.maxCatchUpSteps = maxCatchUpSteps
+        self.dirtyRects = dirtyRects
         self.running = True        
         
+    def playMusic(self, fileName, data=None):
+        """
+        Play a music in loop, from memory if it was read in the background
+        """
+        if data is None and self.musicLoader.finished:
+            data = self.musicLoader.musics.get(fileName)
+        if data is None:
+            pygame.mixer.music.load(fileName)
+        else:
+            # The music is streamed from the file object while it plays
+            self.musicFile = io.BytesIO(data)
+            pygame.mixer.music.load(self.musicFile, fileName)
+        pygame.mixer.music.play(loops=-1)
+
     def gameWon(self):
         self.showMessage('Victory !')
-        pygame.mixer.music.load("17382_1461858477.ogg")
-        pygame.mixer.music.play(loops=-1)
+        self.playMusic(gameWonMusic)
 
     def gameLost(self):
         self.showMessage("GAME OVER")
-        pygame.mixer.music.load("17675_1462199580.ogg")
-        pygame.mixer.music.play(loops=-1)
+        self.playMusic(gameLostMusic)
 
     def loadLevelRequested(self, fileName):
-        if self.playGameMode is None:
+        self.pendingReplayFileName = None
+        self.showOverlay(LoadingGameMode(LevelLoader(fileName, levelMusic).start()))
+
+    def replayRequested(self, fileName):
+        try:
+            reader = ReplayReader(fileName)
+            levelFileName = reader.levelFileName
+            reader.close()
+        except Exception as ex:
+            print(ex)
+            self.showMessage("Replay loading failed :-(")
+            return
+        self.pendingReplayFileName = fileName
+        self.showOverlay(LoadingGameMode(LevelLoader(levelFileName, levelMusic).start()))
+
+    def levelLoaded(self, loader):
+        """
+        Switch to the loaded level (the play mode is only changed here, in the main loop)
+        """
+        for fileName, image in loader.images.items():
+            assets.preloadImage(fileName, image)
+        replayFileName = self.pendingReplayFileName
+        self.pendingReplayFileName = None
+        if replayFileName is not None:
+            self.closePlayGameMode()
+            try:
+                self.playGameMode = ReplayPlayGameMode(replayFileName)
+                self.playGameMode.dirtyRects = self.dirtyRects
+            except Exception as ex:
+                print(ex)
+                assets.clearPreloadedImages()
+                self.showMessage("Replay loading failed :-(")
+                return
+            self.playGameMode.addObserver(self)
+        elif self.playGameMode is None or type(self.playGameMode) is not PlayGameMode:
+            # Replays and network games have their own play mode
+            self.closePlayGameMode()
             self.playGameMode = PlayGameMode()
+            self.playGameMode.dirtyRects = self.dirtyRects
             self.playGameMode.addObserver(self)
-        self.playGameMode.commands.append(LoadLevelCommand(self.playGameMode,fileName))
+        success = self.loadLevel(loader.fileName, loader.level)
+        assets.clearPreloadedImages()
+        if not success:
+            return
+        if replayFileName is None and self.recordFile is not None:
+            self.recorder = Recorder(self.recordFile, loader.fileName)
+            self.playGameMode.recorder = self.recorder
+        self.playMusic(levelMusic, loader.music)
+
+    def joinRequested(self, address):
+        """
+        Play the game of a server (see network module), at HOST:PORT
+        """
+        try:
+            host, port = address.rsplit(':', 1)
+            client = GameClient(host, int(port))
+            client.join()
+        except Exception as ex:
+            print(ex)
+            self.showMessage("Connection failed :-(")
+            return
+        self.closePlayGameMode()
+        self.playGameMode = ClientPlayGameMode(client)
+        self.playGameMode.dirtyRects = self.dirtyRects
+        self.playGameMode.addObserver(self)
+        if self.loadLevel(client.levelFileName):
+            self.playMusic(levelMusic)
+
+    def levelLoadingFailed(self, error):
+        print(error)
+        self.showMessage("Level loading failed :-(")
+
+    def loadLevel(self, fileName, level=None):
+        """
+        Load a level in the current play mode, and returns true on success
+        """
+        self.closeRecorder()
+        self.playGameMode.commands.append(LoadLevelCommand(self.playGameMode,fileName,level))
         try:
             self.playGameMode.update()
             self.currentActiveMode = 'Play'
+            return True
         except Exception as ex:
             print(ex)
-            self.playGameMode = None
+            self.closePlayGameMode()
             self.showMessage("Level loading failed :-(")
+            return False
 
-        pygame.mixer.music.load("17687_1462199612.ogg")
-        pygame.mixer.music.play(loops=-1)
+    def closeRecorder(self):
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
+            if self.playGameMode is not None:
+                self.playGameMode.recorder = None
 
     def worldSizeChanged(self, worldSize):
-        self.window = pygame.display.set_mode((int(worldSize.x),int(worldSize.y)))
+        # The window is never larger than the default size: the camera scrolls big worlds
+        width = min(int(worldSize.x),self.maxWindowSize[0])
+        height = min(int(worldSize.y),self.maxWindowSize[1])
+        if self.window.get_size() != (width,height):
+            self.window = pygame.display.set_mode((width,height))
         
     def showGameRequested(self):
         if self.playGameMode is not None:
             self.currentActiveMode = 'Play'
 
     def showMenuRequested(self):
-        self.overlayGameMode = MenuGameMode()
-        self.overlayGameMode.addObserver(self)
-        self.currentActiveMode = 'Overlay'
+        self.showOverlay(MenuGameMode())
         
     def showMessage(self, message):
-        self.overlayGameMode = MessageGameMode(message)
+        self.showOverlay(MessageGameMode(message))
+
+    def showOverlay(self, overlayGameMode):
+        """
+        Activate an overlay mode, and release the previous one
+        (after the creation of the new one, so shared assets are not reloaded)
+        """
+        if self.overlayGameMode is not None:
+            self.overlayGameMode.release()
+        self.overlayGameMode = overlayGameMode
         self.overlayGameMode.addObserver(self)
         self.currentActiveMode = 'Overlay'
-        
-    def quitRequested(self):
-        self.running = False
+        # The game is drawn again under the new overlay
+        self.pausedFrame = None
 
-    def loadLevel(self, fileName):
-        if self.playGameMode is None:
-            self.playGameMode = PlayGameMode()
-        self.playGameMode.commands.append(LoadLevelCommand(self.playGameMode,fileName))
-        try:
-            self.playGameMode.update()
-            self.currentActiveMode = 'Play'
-        except Exception as ex:
-            print(ex)
-            self.playGameMode = None
-            self.showMessage("Level loading failed :-(")
-        
-    def showGame(self):
-        if self.playGameMode is not None:
-            self.currentActiveMode = 'Play'
+    def composeOverlay(self, alpha):
+        """
+        Returns the frame of the active overlay: the overlay drawn on the darkened
+        paused game (if any). The game is drawn once when the overlay is shown or
+        the window size changes, and the overlay only when it changed.
+        """
+        size = self.window.get_size()
+        if self.pausedFrame is None or self.pausedFrame.get_size() != size:
+            if self.playGameMode is not None:
+                self.playGameMode.invalidate()
+                self.playGameMode.render(self.window,alpha)
+            else:
+                self.window.fill((0,0,0))
+            self.pausedFrame = self.window.copy()
+            self.overlaySurfaceMode = None
+        if self.overlaySurface is None or self.overlaySurface.get_size() != size:
+            self.overlaySurface = pygame.Surface(size, flags=pygame.SRCALPHA)
+            self.overlaySurfaceMode = None
+        if self.overlayGameMode.changed or self.overlaySurfaceMode is not self.overlayGameMode:
+            self.overlaySurface.fill((0,0,0,150))
+            self.overlayGameMode.render(self.overlaySurface)
+            self.overlayGameMode.changed = False
+            self.overlaySurfaceMode = self.overlayGameMode
+            self.overlayFrame = self.pausedFrame.copy()
+            self.overlayFrame.blit(self.overlaySurface, (0,0))
+        return self.overlayFrame
 
-    def showMenu(self):
-        self.overlayGameMode = MenuGameMode()
-        self.currentActiveMode = 'Overlay'
-        
-    def showMessage(self, message):
-        self.overlayGameMode = MessageGameMode(message)
-        self.currentActiveMode = 'Overlay'
+    def closePlayGameMode(self):
+        self.closeRecorder()
+        if self.playGameMode is not None:
+            self.playGameMode.release()
+            self.playGameMode = None
         
-    def quitGame(self):
+    def quitRequested(self):
         self.running = False
-       
+
     def run(self):
+        stepTime = 1 / self.simulationRate
+        accumulator = 0
+        previousTime = time.perf_counter()
         while self.running:
+            frameStartTime = profiler.start()
+            currentTime = time.perf_counter()
+            elapsedTime = currentTime - previousTime
+            previousTime = currentTime
+
             # Inputs and updates are exclusives
             if self.currentActiveMode == 'Overlay':
                 self.overlayGameMode.processInput()
-                self.overlayGameMode.update()
-            elif self.playGameMode is not None:
-                self.playGameMode.processInput()
+                # Menu actions are run when their events are dispatched
                 try:
-                    self.playGameMode.update()
+                    self.overlayGameMode.update()
                 except Exception as ex:
                     print(ex)
-                    self.playGameMode = None
-                    self.showMessage("Error during the game update...")
+                    self.showMessage("Error during the menu action...")
+            elif self.playGameMode is not None:
+                # Fixed time steps (the game is paused while an overlay is active)
+                accumulator += elapsedTime
+                steps = 0
+                while accumulator >= stepTime and steps < self.maxCatchUpSteps:
+                    startTime = profiler.start()
+                    self.playGameMode.processInput()
+                    profiler.stop('phase','input',startTime)
+                    startTime = profiler.start()
+                    try:
+                        self.playGameMode.update()
+                    except Exception as ex:
+                        print(ex)
+                        self.closePlayGameMode()
+                        self.showMessage("Error during the game update...")
+                    profiler.stop('phase','update',startTime)
+                    accumulator -= stepTime
+                    steps += 1
+                    if self.playGameMode is None or self.currentActiveMode != 'Play':
+                        break
+                # Too many late epochs: drop them
+                if accumulator >= stepTime:
+                    accumulator %= stepTime
+            alpha = min(1,accumulator / stepTime)
                     
-            # Render game (if any), and then the overlay (if active)
-            if self.playGameMode is not None:
-                self.playGameMode.render(self.window)
+            # Render the overlay over the paused game (if active), or the game (if any)
+            startTime = profiler.start()
+            rects = None
+            if self.currentActiveMode == 'Overlay':
+                self.window.blit(self.composeOverlay(alpha), (0,0))
+            elif self.playGameMode is not None:
+                rects = self.playGameMode.render(self.window,alpha)
             else:
                 self.window.fill((0,0,0))
-            if self.currentActiveMode == 'Overlay':
-                darkSurface = pygame.Surface(self.window.get_size(),flags=pygame.SRCALPHA)
-                pygame.draw.rect(darkSurface, (0,0,0,150), darkSurface.get_rect())
-                self.window.blit(darkSurface, (0,0))
-                self.overlayGameMode.render(self.window)
+            profiler.stop('phase','render',startTime)
+            if profiler.enabled:
+                self.profilerOverlay.render(self.window)
+                rects = None
+            
+            # The game must draw all the window after something was drawn over it
+            if rects is None and self.playGameMode is not None:
+                self.playGameMode.invalidate()
                 
-            # Update display
-            pygame.display.update()    
-            self.clock.tick(60)
+            # Update display (only the changed rects, if the game gave them)
+            startTime = profiler.start()
+            if rects is None:
+                pygame.display.update()    
+            else:
+                pygame.display.update(rects)
+            profiler.stop('phase','display',startTime)
+            profiler.stop('phase','frame',frameStartTime)
+            profiler.endFrame()
+            self.clock.tick(self.frameRate)
+
+parser = argparse.ArgumentParser(description="Tank game")
+parser.add_argument('--record', metavar='FILE', help="record the player's inputs of the last played level")
+parser.add_argument('--replay', metavar='FILE', help="watch a recorded game")
+parser.add_argument('--connect', metavar='HOST:PORT', help="join a game server (see network.py)")
+parser.add_argument('--profile', metavar='FILE', help="save the timings of the last frames on exit (CSV, or JSON if FILE ends with .json)")
+parser.add_argument('--sim-rate', type=float, default=60, help="game epochs per second")
+parser.add_argument('--fps', type=int, default=60, help="maximum frames per second (0: no limit)")
+parser.add_argument('--max-catch-up', type=int, default=5, help="maximum number of epochs per frame")
+parser.add_argument('--full-redraw', action='store_true', help="draw and update all the window at each frame (no dirty rects)")
+args = parser.parse_args()
+if args.profile is not None:
+    profiler.enable()
 
-userInterface = UserInterface()
+userInterface = UserInterface(args.record, args.sim_rate, args.fps, args.max_catch_up, not args.full_redraw)
+if args.replay is not None:
+    userInterface.replayRequested(args.replay)
+elif args.connect is not None:
+    userInterface.joinRequested(args.connect)
 userInterface.run()
+userInterface.closeRecorder()
+if args.profile is not None:
+    profiler.dump(args.profile)
             
 pygame.quit()
\ No newline at end of file
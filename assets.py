@@ -0,0 +1,175 @@
+import pygame
+from collections import OrderedDict
+from pygame.math import Vector2
+
+
+class Tileset():
+    """
+    Texture sliced in tiles of cellSize pixels.
+
+    Tiles are subsurfaces of the texture: they share its pixels and are
+    blitted without any conversion or area computation.
+    """
+    def __init__(self,texture,cellSize):
+        self.texture = texture
+        self.cellSize = Vector2(cellSize)
+        cellWidth = int(cellSize.x)
+        cellHeight = int(cellSize.y)
+        columns = texture.get_width() // cellWidth
+        rows = texture.get_height() // cellHeight
+        self.tiles = [
+            [
+                texture.subsurface((x * cellWidth,y * cellHeight,cellWidth,cellHeight))
+                for x in range(columns)
+            ]
+            for y in range(rows)
+        ]
+
+    def tile(self,tile):
+        """
+        Returns the surface of a tile, given its coordinates in the texture (in tiles)
+        """
+        return self.tiles[int(tile.y)][int(tile.x)]
+
+
+class TextCache():
+    """
+    Rendered texts, keyed by (font, text, color, antialias).
+
+    The least recently used texts are evicted when there are more than maxSize texts.
+    """
+    def __init__(self,maxSize=256):
+        self.maxSize = maxSize
+        self.texts = OrderedDict()
+
+    def render(self,font,text,color,antialias=True):
+        key = (font,text,tuple(color),antialias)
+        surface = self.texts.get(key)
+        if surface is None:
+            surface = font.render(text,antialias,color)
+            self.texts[key] = surface
+            if len(self.texts) > self.maxSize:
+                self.texts.popitem(last=False)
+        else:
+            self.texts.move_to_end(key)
+        return surface
+
+    def removeFont(self,font):
+        """
+        Remove the texts of a font
+        """
+        for key in [ key for key in self.texts if key[0] is font ]:
+            del self.texts[key]
+
+    def clear(self):
+        self.texts.clear()
+
+
+class AssetManager():
+    """
+    Process-wide cache of images, tilesets, fonts and sounds.
+
+    Each load increments the reference count of an asset, and each release
+    decrements it: an asset is loaded once and freed when nobody uses it.
+    To switch between two users of the same asset without reloading it, load
+    it for the new user before releasing it for the old one.
+    """
+    def __init__(self):
+        self.assets = {}
+        # Images decoded in advance (see preloadImage)
+        self.decodedImages = {}
+        self.textCache = TextCache()
+
+    def acquire(self,key,loader):
+        entry = self.assets.get(key)
+        if entry is None:
+            entry = [ loader(), 0 ]
+            self.assets[key] = entry
+        entry[1] += 1
+        return entry[0]
+
+    def release(self,key):
+        entry = self.assets.get(key)
+        if entry is None:
+            return
+        entry[1] -= 1
+        if entry[1] <= 0:
+            del self.assets[key]
+
+    def referenceCount(self,key):
+        entry = self.assets.get(key)
+        return 0 if entry is None else entry[1]
+
+    def clear(self):
+        self.assets.clear()
+        self.decodedImages.clear()
+        self.textCache.clear()
+
+    def convert(self,surface,alpha=True):
+        """
+        Convert a surface to the display pixel format, if there is a display
+        """
+        if pygame.display.get_surface() is None:
+            return surface
+        if alpha:
+            return surface.convert_alpha()
+        return surface.convert()
+
+    def preloadImage(self,fileName,image):
+        """
+        Give the pixels of an image decoded in advance (for instance by a loading 
+        thread): the next load of this image uses them instead of the file.
+        Nothing is done if the image is already loaded.
+        """
+        if ('image',fileName) not in self.assets:
+            self.decodedImages[fileName] = image
+
+    def clearPreloadedImages(self):
+        self.decodedImages.clear()
+
+    def decodeImage(self,fileName):
+        image = self.decodedImages.pop(fileName,None)
+        if image is None:
+            image = pygame.image.load(fileName)
+        return self.convert(image)
+
+    def loadImage(self,fileName):
+        return self.acquire(('image',fileName),lambda: self.decodeImage(fileName))
+
+    def releaseImage(self,fileName):
+        self.release(('image',fileName))
+
+    def loadTileset(self,fileName,cellSize):
+        key = ('tileset',fileName,int(cellSize.x),int(cellSize.y))
+        return self.acquire(key,lambda: Tileset(self.loadImage(fileName),cellSize))
+
+    def releaseTileset(self,fileName,cellSize):
+        key = ('tileset',fileName,int(cellSize.x),int(cellSize.y))
+        if self.referenceCount(key) == 1:
+            self.releaseImage(fileName)
+        self.release(key)
+
+    def loadFont(self,fileName,size):
+        return self.acquire(('font',fileName,size),lambda: pygame.font.Font(fileName,size))
+
+    def releaseFont(self,fileName,size):
+        key = ('font',fileName,size)
+        if self.referenceCount(key) == 1:
+            self.textCache.removeFont(self.assets[key][0])
+        self.release(key)
+
+    def renderText(self,font,text,color,antialias=True):
+        """
+        Returns the surface of a text, rendered once (see TextCache)
+        """
+        return self.textCache.render(font,text,color,antialias)
+
+    def loadSound(self,fileName):
+        return self.acquire(('sound',fileName),lambda: pygame.mixer.Sound(fileName))
+
+    def releaseSound(self,fileName):
+        self.release(('sound',fileName))
+
+
+# Assets shared by all game modes and layers
+assets = AssetManager()
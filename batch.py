@@ -0,0 +1,137 @@
+import os
+import sys
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from headless import HeadlessRunner, createPolicy, policies, useDummyDrivers
+from levelcache import loadLevel
+from unit import Status
+
+
+def runMatch(job):
+    """
+    Run a headless match, job being (level file, seed, policy name, max epochs)
+
+    Returns a dictionary with the job and the match results
+    """
+    fileName, seed, policyName, maxEpochs = job
+    runner = HeadlessRunner(fileName,createPolicy(policyName,seed))
+    runner.run(maxEpochs)
+    state = runner.gameState
+    return {
+        'level': fileName,
+        'seed': seed,
+        'policy': policyName,
+        'winner': runner.winner,
+        'epochs': runner.epochCount,
+        'shotsFired': state.bullets.firedCount,
+        'unitsDestroyed': sum(1 for unit in state.units if unit.status == Status.DESTROYED),
+        'time': runner.elapsedTime
+    }
+
+
+class BatchStatistics():
+    """
+    Aggregated results of a batch of matches
+    """
+    def __init__(self):
+        self.startTime = time.perf_counter()
+        self.matchCount = 0
+        self.winners = {}
+        self.epochCount = 0
+        self.shotsFired = 0
+        self.unitsDestroyed = 0
+
+    def add(self,result):
+        self.matchCount += 1
+        winner = result['winner'] if result['winner'] is not None else 'none'
+        self.winners[winner] = self.winners.get(winner,0) + 1
+        self.epochCount += result['epochs']
+        self.shotsFired += result['shotsFired']
+        self.unitsDestroyed += result['unitsDestroyed']
+
+    @property
+    def elapsedTime(self):
+        return time.perf_counter() - self.startTime
+
+    @property
+    def matchesPerSecond(self):
+        elapsedTime = self.elapsedTime
+        return self.matchCount / elapsedTime if elapsedTime > 0 else 0
+
+    @property
+    def epochsPerSecond(self):
+        elapsedTime = self.elapsedTime
+        return self.epochCount / elapsedTime if elapsedTime > 0 else 0
+
+
+def runBatch(jobs,workerCount=None,maxPendingJobs=None):
+    """
+    Run jobs (see runMatch) in a pool of processes, and yield the results as soon
+    as matches end (not in the jobs order).
+
+    jobs can be any iterable: at most maxPendingJobs jobs are submitted at once,
+    so memory use does not depend on the number of jobs.
+    """
+    if workerCount is None:
+        workerCount = os.cpu_count() or 1
+    if maxPendingJobs is None:
+        maxPendingJobs = 4 * workerCount
+    jobs = iter(jobs)
+    with ProcessPoolExecutor(max_workers=workerCount) as executor:
+        pending = set()
+        while True:
+            for job in jobs:
+                pending.add(executor.submit(runMatch,job))
+                if len(pending) >= maxPendingJobs:
+                    break
+            if len(pending) == 0:
+                break
+            done, pending = wait(pending,return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+
+
+if __name__ == '__main__':
+    useDummyDrivers()
+
+    parser = argparse.ArgumentParser(description="Run headless matches in parallel")
+    parser.add_argument('levels', nargs='+', help="TMX level files")
+    parser.add_argument('--matches', type=int, default=100, help="number of matches per level (one seed per match)")
+    parser.add_argument('--policy', choices=sorted(policies.keys()), default='random', help="player's policy")
+    parser.add_argument('--epochs', type=int, default=10000, help="maximum number of epochs per match")
+    parser.add_argument('--workers', type=int, default=None, help="number of processes (default: number of cores)")
+    parser.add_argument('--output', default=None, help="JSON lines file for the results of each match")
+    args = parser.parse_args()
+
+    # Compile levels once, before workers try to do it concurrently
+    try:
+        for fileName in args.levels:
+            loadLevel(fileName)
+    except Exception as ex:
+        print(ex)
+        sys.exit(1)
+
+    jobs = (
+        (fileName,seed,args.policy,args.epochs)
+        for fileName in args.levels
+        for seed in range(args.matches)
+    )
+    output = open(args.output,'w') if args.output is not None else None
+    statistics = BatchStatistics()
+    try:
+        for result in runBatch(jobs,args.workers):
+            statistics.add(result)
+            if output is not None:
+                output.write(json.dumps(result) + '\n')
+    finally:
+        if output is not None:
+            output.close()
+
+    print("Matches: {} ({:.1f} matches/s)".format(statistics.matchCount,statistics.matchesPerSecond))
+    for winner, count in sorted(statistics.winners.items()):
+        print("Winner {}: {}".format(winner,count))
+    print("Epochs: {} ({:.0f} epochs/s)".format(statistics.epochCount,statistics.epochsPerSecond))
+    print("Shots fired: {}".format(statistics.shotsFired))
+    print("Units destroyed: {}".format(statistics.unitsDestroyed))
@@ -0,0 +1,307 @@
+import sys
+import json
+import time
+import platform
+import argparse
+import numpy as np
+import pygame
+from pygame.math import Vector2
+from level import Level
+from levelcache import loadLevel
+from gamemode import PlayGameMode
+from command import LoadLevelCommand
+from unit import Bullet, Status
+from headless import useDummyDrivers
+
+# Names of the play mode layers, in order
+layerNames = [ 'ground', 'walls', 'units', 'bullets', 'explosions', 'sounds' ]
+resultsVersion = 1
+
+
+class Scenario():
+    """
+    Level of a benchmark, with bulletCount bullets kept in flight during the updates
+    """
+    def __init__(self,name,bulletCount=0):
+        self.name = name
+        self.bulletCount = bulletCount
+
+    def createLevel(self):
+        """
+        Returns the decoded level (see level module)
+        """
+        raise NotImplementedError()
+
+class LevelFileScenario(Scenario):
+    """
+    A level file
+    """
+    def __init__(self,name,fileName,bulletCount=0):
+        super().__init__(name,bulletCount)
+        self.fileName = fileName
+
+    def createLevel(self):
+        return loadLevel(self.fileName)
+
+class SyntheticScenario(Scenario):
+    """
+    A random level of width x height cells, with walls in a wallDensity ratio
+    of the cells, and tankCount tanks and towerCount towers in the other ones.
+
+    Tilesets and tiles are the ones of a template level file. The first tank
+    (in row order) is the player's one.
+    """
+    def __init__(self,name,width,height,wallDensity,tankCount,towerCount,bulletCount,seed=0,templateFileName="level2.tmx"):
+        super().__init__(name,bulletCount)
+        self.width = width
+        self.height = height
+        self.wallDensity = wallDensity
+        self.tankCount = tankCount
+        self.towerCount = towerCount
+        self.seed = seed
+        self.templateFileName = templateFileName
+
+    def createLevel(self):
+        template = loadLevel(self.templateFileName)
+        generator = np.random.default_rng(self.seed)
+        shape = (self.height,self.width)
+        def templateTiles(layerIndex):
+            tileIds = np.unique(template.tileIds[layerIndex])
+            return tileIds[tileIds >= 0]
+
+        ground = generator.choice(templateTiles(0),shape).astype(np.int32)
+        walls = np.full(shape,-1,dtype=np.int32)
+        wallCells = generator.random(shape) < self.wallDensity
+        walls[wallCells] = generator.choice(templateTiles(1),np.count_nonzero(wallCells))
+
+        # Units in free cells
+        freeCells = np.flatnonzero(~wallCells)
+        unitCount = self.tankCount + self.towerCount
+        if unitCount > len(freeCells):
+            raise RuntimeError("Error in scenario {}: too many units".format(self.name))
+        unitCells = generator.choice(freeCells,unitCount,replace=False)
+        tanks = np.full(shape,-1,dtype=np.int32)
+        tanks.flat[unitCells[:self.tankCount]] = templateTiles(2)[0]
+        towers = np.full(shape,-1,dtype=np.int32)
+        towers.flat[unitCells[self.tankCount:]] = generator.choice(templateTiles(3),self.towerCount)
+        explosions = np.full(shape,-1,dtype=np.int32)
+
+        return Level(self.width,self.height,template.tilesets,[ ground, walls, tanks, towers, explosions ])
+
+scenarios = {
+    'level1': LevelFileScenario('level1',"level1.tmx"),
+    'level2': LevelFileScenario('level2',"level2.tmx"),
+    'small': SyntheticScenario('small',32,32,0.1,10,20,100),
+    'medium': SyntheticScenario('medium',128,128,0.15,100,300,1000),
+    'large': SyntheticScenario('large',256,256,0.2,500,1500,5000)
+}
+
+
+def benchmarkLoad(gameMode,scenario,level,repeatCount):
+    """
+    Returns the best time of LoadLevelCommand, in ms
+    """
+    times = [ ]
+    for index in range(repeatCount):
+        command = LoadLevelCommand(gameMode,scenario.name,level)
+        startTime = time.perf_counter()
+        command.run()
+        times.append(time.perf_counter() - startTime)
+    return 1000 * min(times)
+
+def fillBullets(gameMode,bulletCount,generator):
+    """
+    Fire bullets from random live units towards random cells in their range,
+    until there are bulletCount bullets
+    """
+    state = gameMode.gameState
+    missingCount = bulletCount - len(state.bullets)
+    if missingCount <= 0:
+        return
+    units = [ unit for unit in state.units if unit.status == Status.ALIVE ]
+    if len(units) == 0:
+        return
+    angles = generator.uniform(0,2 * np.pi,missingCount)
+    for unitIndex, angle in zip(generator.integers(0,len(units),missingCount),angles):
+        bullet = Bullet(state,units[unitIndex])
+        bullet.endPosition = bullet.startPosition + Vector2(np.cos(angle),np.sin(angle)) * state.bulletRange
+        state.bullets.append(bullet)
+
+def benchmarkUpdate(gameMode,scenario,epochCount,repeatCount,generator):
+    """
+    Returns the best number of epochs per second of repeatCount runs.
+
+    Each epoch has the commands of the enemies (the player is idle), and the
+    time to fill the bullets is not measured.
+    """
+    rates = [ ]
+    for index in range(repeatCount):
+        elapsedTime = 0
+        for epoch in range(epochCount):
+            fillBullets(gameMode,scenario.bulletCount,generator)
+            startTime = time.perf_counter()
+            gameMode.createEnemyCommands([ gameMode.playerUnit ])
+            gameMode.commands.moveBullets(len(gameMode.gameState.bullets))
+            gameMode.update()
+            elapsedTime += time.perf_counter() - startTime
+        rates.append(epochCount / elapsedTime)
+    return max(rates)
+
+def benchmarkRender(gameMode,frameCount,repeatCount,generator,windowSize=(1280,720)):
+    """
+    Returns the time of each layer to render a frame in an offscreen surface,
+    in ms, with the camera on random cells: the average of the frames of the
+    best of repeatCount passes over the cells (after a first pass not measured)
+    """
+    surface = pygame.Surface(windowSize).convert()
+    state = gameMode.gameState
+    camera = gameMode.camera
+    camera.viewSize = Vector2(windowSize)
+    camera.worldSize = state.worldSize
+    targets = [
+        Vector2(float(x),float(y)) for x, y in zip(
+            generator.integers(0,state.worldWidth,frameCount),
+            generator.integers(0,state.worldHeight,frameCount)
+        )
+    ]
+    times = np.zeros((repeatCount + 1,len(gameMode.layers)))
+    for passTimes in times:
+        for target in targets:
+            camera.follow(target)
+            for index, layer in enumerate(gameMode.layers):
+                startTime = time.perf_counter()
+                layer.render(surface,camera,0.5)
+                passTimes[index] += time.perf_counter() - startTime
+    bestTimes = times[1:].min(axis=0)
+    return { layerNames[index]: 1000 * bestTimes[index] / frameCount for index in range(len(bestTimes)) }
+
+def runScenario(scenario,epochCount,frameCount,repeatCount,seed=0):
+    """
+    Returns the metrics of a scenario: a dictionary of values by name
+    """
+    generator = np.random.default_rng(seed)
+    level = scenario.createLevel()
+    gameMode = PlayGameMode()
+    results = { }
+    results['load.ms'] = benchmarkLoad(gameMode,scenario,level,repeatCount)
+    results['update.epochsPerSecond'] = benchmarkUpdate(gameMode,scenario,epochCount,repeatCount,generator)
+    for name, value in benchmarkRender(gameMode,frameCount,repeatCount,generator).items():
+        results['render.{}.ms'.format(name)] = value
+    gameMode.release()
+    return results
+
+def runBenchmarks(names,epochCount,frameCount,repeatCount,log=None):
+    """
+    Run scenarios, and returns the results (see compareResults)
+    """
+    # A window is needed to convert the surfaces as the game does
+    pygame.init()
+    pygame.display.set_mode((1,1))
+    results = {
+        'version': resultsVersion,
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'pygame': pygame.version.ver,
+        'numpy': np.__version__,
+        'settings': {
+            'epochs': epochCount,
+            'frames': frameCount,
+            'repeat': repeatCount
+        },
+        'scenarios': { }
+    }
+    for name in names:
+        if name not in scenarios:
+            raise RuntimeError("Unknown scenario {}".format(name))
+        if log is not None:
+            log("Scenario {}...".format(name))
+        results['scenarios'][name] = runScenario(scenarios[name],epochCount,frameCount,repeatCount)
+    pygame.quit()
+    return results
+
+def isBetter(metric,value,reference):
+    """
+    Returns true if value is better than reference: rates are better when higher, times when lower
+    """
+    if metric.endswith('PerSecond'):
+        return value > reference
+    return value < reference
+
+def compareResults(baseline,current,threshold,minTime=0.05):
+    """
+    Compare the metrics found in both results.
+
+    Returns a list of (scenario, metric, baseline value, current value, change
+    in %, regression). A regression is a change worse than threshold %; times
+    changing by less than minTime ms are too short to be regressions.
+    """
+    comparisons = [ ]
+    for scenarioName, metrics in current['scenarios'].items():
+        baselineMetrics = baseline['scenarios'].get(scenarioName)
+        if baselineMetrics is None:
+            continue
+        for metric, value in metrics.items():
+            reference = baselineMetrics.get(metric)
+            if reference is None or reference == 0:
+                continue
+            change = 100 * (value - reference) / reference
+            regression = not isBetter(metric,value,reference) and abs(change) > threshold
+            if metric.endswith('.ms') and abs(value - reference) < minTime:
+                regression = False
+            comparisons.append((scenarioName,metric,reference,value,change,regression))
+    return comparisons
+
+def loadResults(fileName):
+    with open(fileName,'r') as file:
+        results = json.load(file)
+    if results.get('version') != resultsVersion:
+        raise RuntimeError("Error in {}: invalid results file".format(fileName))
+    return results
+
+
+if __name__ == '__main__':
+    useDummyDrivers()
+
+    parser = argparse.ArgumentParser(description="Benchmarks of the game updates, layers rendering and level loading")
+    commands = parser.add_subparsers(dest='command', required=True)
+    runParser = commands.add_parser('run', help="run scenarios, and save the results (JSON)")
+    runParser.add_argument('--scenarios', default=','.join(scenarios.keys()), help="comma separated scenarios among {}".format(', '.join(scenarios.keys())))
+    runParser.add_argument('--epochs', type=int, default=200, help="epochs per update run")
+    runParser.add_argument('--frames', type=int, default=30, help="rendered frames")
+    runParser.add_argument('--repeat', type=int, default=3, help="runs of each measure (the best one is kept)")
+    runParser.add_argument('--output', metavar='FILE', help="results file (for instance a baseline)")
+    compareParser = commands.add_parser('compare', help="compare results with a baseline")
+    compareParser.add_argument('baseline', help="baseline results file")
+    compareParser.add_argument('current', help="current results file")
+    compareParser.add_argument('--threshold', type=float, default=15, help="largest accepted slowdown, in %%")
+    compareParser.add_argument('--min-time', type=float, default=0.05, help="smallest time change that can be a regression, in ms")
+    args = parser.parse_args()
+
+    try:
+        if args.command == 'run':
+            results = runBenchmarks(args.scenarios.split(','), args.epochs, args.frames, args.repeat, print)
+            for scenarioName, metrics in results['scenarios'].items():
+                for metric, value in metrics.items():
+                    print("{:<8} {:<28} {:>10.3f}".format(scenarioName, metric, value))
+            if args.output is not None:
+                with open(args.output, 'w') as file:
+                    json.dump(results, file, indent=2)
+        else:
+            baseline = loadResults(args.baseline)
+            current = loadResults(args.current)
+            if baseline['settings'] != current['settings']:
+                print("Warning: the results were not run with the same settings")
+            comparisons = compareResults(baseline, current, args.threshold, args.min_time)
+            regressionCount = 0
+            for scenarioName, metric, reference, value, change, regression in comparisons:
+                if regression:
+                    regressionCount += 1
+                print("{:<8} {:<28} {:>10.3f} {:>10.3f} {:>+8.1f}%{}".format(
+                    scenarioName, metric, reference, value, change, "  REGRESSION" if regression else ""
+                ))
+            print("{} regression(s) beyond {:.0f}%".format(regressionCount, args.threshold))
+            if regressionCount > 0:
+                sys.exit(1)
+    except Exception as ex:
+        print(ex)
+        sys.exit(1)
@@ -0,0 +1,109 @@
+import numpy as np
+
+
+class BulletArray():
+    """
+    Bullets stored as a struct of arrays.
+
+    Row i of each array is the i-th bullet; only the first count rows are used.
+    Bullets are kept in firing order, and the owner of a bullet is the index
+    of the unit in the game state units list. The id of a bullet is the number
+    of bullets fired before it. Positions of the previous epoch are kept for
+    render interpolation.
+    """
+    def __init__(self,capacity=64):
+        self.count = 0
+        # Number of bullets fired since the last clear
+        self.firedCount = 0
+        self.allocate(capacity)
+
+    def allocate(self,capacity):
+        self.positions = np.zeros((capacity,2))
+        self.previousPositions = np.zeros((capacity,2))
+        self.directions = np.zeros((capacity,2))
+        self.startPositions = np.zeros((capacity,2))
+        self.endPositions = np.zeros((capacity,2))
+        self.owners = np.zeros(capacity,dtype=np.int32)
+        self.ids = np.zeros(capacity,dtype=np.int64)
+
+    @property
+    def capacity(self):
+        return len(self.owners)
+
+    def __len__(self):
+        return self.count
+
+    def grow(self):
+        """
+        Double the capacity of the arrays, keeping the current bullets
+        """
+        count = self.count
+        positions = self.positions[:count]
+        previousPositions = self.previousPositions[:count]
+        directions = self.directions[:count]
+        startPositions = self.startPositions[:count]
+        endPositions = self.endPositions[:count]
+        owners = self.owners[:count]
+        ids = self.ids[:count]
+        self.allocate(2 * self.capacity)
+        self.positions[:count] = positions
+        self.previousPositions[:count] = previousPositions
+        self.directions[:count] = directions
+        self.startPositions[:count] = startPositions
+        self.endPositions[:count] = endPositions
+        self.owners[:count] = owners
+        self.ids[:count] = ids
+
+    def append(self,bullet):
+        """
+        Add a bullet fired by a unit (see the Bullet class)
+        """
+        if self.count == self.capacity:
+            self.grow()
+        index = self.count
+        start = bullet.startPosition
+        end = bullet.endPosition
+        self.positions[index] = (bullet.position.x,bullet.position.y)
+        self.previousPositions[index] = self.positions[index]
+        self.startPositions[index] = (start.x,start.y)
+        self.endPositions[index] = (end.x,end.y)
+        # Bullets fired at their own cell get a null direction: they are destroyed on their first move
+        length = (end - start).length()
+        if length > 0:
+            self.directions[index] = ((end.x - start.x) / length,(end.y - start.y) / length)
+        else:
+            self.directions[index] = (0,0)
+        self.owners[index] = bullet.state.unitIndex(bullet.unit)
+        self.ids[index] = self.firedCount
+        self.count += 1
+        self.firedCount += 1
+
+    def clear(self):
+        self.count = 0
+        self.firedCount = 0
+
+    def keep(self,mask):
+        """
+        Keep the bullets where mask is True, in the same order
+        """
+        count = self.count
+        kept = int(np.count_nonzero(mask))
+        self.positions[:kept] = self.positions[:count][mask]
+        self.previousPositions[:kept] = self.previousPositions[:count][mask]
+        self.directions[:kept] = self.directions[:count][mask]
+        self.startPositions[:kept] = self.startPositions[:count][mask]
+        self.endPositions[:kept] = self.endPositions[:count][mask]
+        self.owners[:kept] = self.owners[:count][mask]
+        self.ids[:kept] = self.ids[:count][mask]
+        self.count = kept
+
+    def renderPositions(self,alpha):
+        """
+        Returns the positions between the last two epochs, with alpha from 0 
+        (previous epoch) to 1 (current epoch)
+        """
+        positions = self.positions[:self.count]
+        if alpha >= 1:
+            return positions
+        previousPositions = self.previousPositions[:self.count]
+        return previousPositions + alpha * (positions - previousPositions)
@@ -0,0 +1,57 @@
+import math
+from pygame.math import Vector2
+
+
+class Camera():
+    """
+    Viewport on the world.
+
+    The camera position is the world pixel displayed at the top left corner of
+    the screen. World positions are in cells, screen positions in pixels.
+    """
+    def __init__(self,cellSize):
+        self.cellSize = cellSize
+        self.viewSize = Vector2(1280,720)
+        self.worldSize = Vector2(16,10)
+        self.position = Vector2()
+
+    @property
+    def worldPixelSize(self):
+        return self.worldSize.elementwise() * self.cellSize
+
+    def follow(self,target):
+        """
+        Center the camera on a world position, without showing outside the world
+        """
+        center = (target + Vector2(0.5,0.5)).elementwise() * self.cellSize
+        position = center - self.viewSize / 2
+        maxPosition = self.worldPixelSize - self.viewSize
+        self.position.x = int(max(0,min(position.x,maxPosition.x)))
+        self.position.y = int(max(0,min(position.y,maxPosition.y)))
+
+    def worldToScreen(self,position):
+        return position.elementwise() * self.cellSize - self.position
+
+    def screenToWorld(self,point):
+        return (Vector2(point) + self.position).elementwise() / self.cellSize
+
+    def visibleCells(self,margin=0):
+        """
+        Returns the range (x0, y0, x1, y1) of visible cells, with x1 and y1 excluded.
+
+        The range is extended by margin cells on each side and cropped to the world.
+        """
+        x0 = int(self.position.x // self.cellSize.x) - margin
+        y0 = int(self.position.y // self.cellSize.y) - margin
+        x1 = math.ceil((self.position.x + self.viewSize.x) / self.cellSize.x) + margin
+        y1 = math.ceil((self.position.y + self.viewSize.y) / self.cellSize.y) + margin
+        return max(0,x0), max(0,y0), min(int(self.worldSize.x),x1), min(int(self.worldSize.y),y1)
+
+    def isVisible(self,position,margin=1):
+        """
+        Returns true if the cell of position is visible, with a margin in cells for
+        sprites larger than a cell
+        """
+        x0, y0, x1, y1 = self.visibleCells(margin)
+        return position.x >= x0 and position.x < x1 \
+           and position.y >= y0 and position.y < y1
@@ -1,8 +1,11 @@
+import time
+import math
 import pygame
+import numpy as np
 from pygame.math import Vector2
-from unit import Unit, Bullet
-import tmx
-import os
+from unit import Unit, Bullet, Status
+from levelcache import loadLevel
+from profiler import profiler
 
 
 class Command():
@@ -21,7 +24,7 @@ class MoveCommand(Command):
         unit = self.unit
         
         # Destroyed units can't move
-        if unit.status != "alive":
+        if unit.status != Status.ALIVE:
             return
 
         # Update unit orientation
@@ -50,7 +53,9 @@ class MoveCommand(Command):
         if not unitIndex is None:
                 return
 
-        unit.position = newPos
+        unit.previousPosition = unit.position
+        self.state.moveUnit(unit,newPos)
+        unit.lastMoveEpoch = self.state.epoch
         
 class TargetCommand(Command):
     def __init__(self,state,unit,target):
@@ -65,200 +70,485 @@ class ShootCommand(Command):
         self.state = state
         self.unit = unit
     def run(self):
-        if self.unit.status != "alive":
+        if self.unit.status != Status.ALIVE:
             return
         if self.state.epoch-self.unit.lastBulletEpoch < self.state.bulletDelay:
             return
         self.unit.lastBulletEpoch = self.state.epoch
         self.state.bullets.append(Bullet(self.state,self.unit))
+        self.state.notifyBulletFired(self.unit)
         
-class MoveBulletCommand(Command):
-    def __init__(self,state,bullet):
+class MoveBulletsCommand(Command):
+    """
+    This command moves the first count bullets, and deletes the destroyed ones.
+    
+    All bullets are processed at once with array operations. Collisions are 
+    swept: all the cells crossed by the bullet centers during the epoch are 
+    tested, so bullets can be as fast as wanted without going through walls 
+    or units.
+
+    Array operations have a fixed cost: below scalarCount bullets, the bullets
+    are moved one by one instead, with the same results.
+    """
+    scalarCount = 32
+
+    def __init__(self,state,count):
         self.state = state
-        self.bullet = bullet
+        self.count = count
     def run(self):
-        direction = (self.bullet.endPosition - self.bullet.startPosition).normalize()
-        newPos = self.bullet.position + self.state.bulletSpeed * direction
-        newCenterPos = newPos + Vector2(0.5,0.5)
-        # If the bullet goes outside the world, destroy it
-        if not self.state.isInside(newPos):
-            self.bullet.status = "destroyed"
-            return
-        # If the bullet goes towards the target cell, destroy it
-        if ((direction.x >= 0 and newPos.x >= self.bullet.endPosition.x) \
-        or (direction.x < 0 and newPos.x <= self.bullet.endPosition.x)) \
-        and ((direction.y >= 0 and newPos.y >= self.bullet.endPosition.y) \
-        or (direction.y < 0 and newPos.y <= self.bullet.endPosition.y)):
-            self.bullet.status = "destroyed"
-            return
-        # If the bullet is outside the allowed range, destroy it
-        if newPos.distance_to(self.bullet.startPosition) >= self.state.bulletRange:  
-            self.bullet.status = "destroyed"
-            return
-        # If the bullet hits a unit, destroy the bullet and the unit 
-        unit = self.state.findLiveUnit(newCenterPos)
-        if not unit is None and unit != self.bullet.unit:
-            self.bullet.status = "destroyed"
-            unit.status = "destroyed"
-            self.state.notifyUnitDestroyed(unit)
+        state = self.state
+        bullets = state.bullets
+        count = min(self.count,len(bullets))
+        if count == 0:
             return
+        if count < self.scalarCount:
+            newPos, destroyed, hitBullets, hitUnits = self.moveScalar(count)
+        else:
+            newPos, destroyed, hitBullets, hitUnits = self.moveArrays(count)
+
+        # If the bullet hits a unit, destroy the bullet and the unit
+        hit = np.zeros(count,dtype=bool)
+        for bulletIndex, unitIndex in zip(hitBullets,hitUnits):
+            unit = state.units[unitIndex]
+            # The bullet may have hit a previous unit on its path, and the unit 
+            # may have been destroyed by a previous bullet
+            if hit[bulletIndex] or unit.status != Status.ALIVE:
+                continue
+            hit[bulletIndex] = True
+            unit.status = Status.DESTROYED
+            state.notifyUnitDestroyed(unit)
+        destroyed |= hit
+
         # Nothing happends, continue bullet trajectory
-        self.bullet.position = newPos
-        
-class DeleteDestroyedCommand(Command):
-    def __init__(self,itemList):
-        self.itemList = itemList
-    def run(self):
-        newList = [ item for item in self.itemList if item.status == "alive" ]
-        self.itemList[:] = newList
+        moving = ~destroyed
+        positions = bullets.positions[:count]
+        bullets.previousPositions[:count] = positions
+        positions[moving] = newPos[moving]
+
+        # Delete destroyed bullets (bullets fired after this command was created are kept)
+        if not moving.all():
+            alive = np.ones(len(bullets),dtype=bool)
+            alive[:count] = moving
+            bullets.keep(alive)
+
+    def moveArrays(self,count):
+        """
+        Returns the new positions of the bullets, the mask of the bullets
+        destroyed by a wall, the world limits or their range, and the hits (see
+        traverse)
+        """
+        state = self.state
+        bullets = state.bullets
+        positions = bullets.positions[:count]
+        directions = bullets.directions[:count]
+        startPositions = bullets.startPositions[:count]
+        endPositions = bullets.endPositions[:count]
+        newPos = positions + state.bulletSpeed * directions
+        newX = newPos[:,0]
+        newY = newPos[:,1]
+
+        # If the bullet goes outside the world, destroy it
+        destroyed = (newX < 0) | (newX >= state.worldWidth) | (newY < 0) | (newY >= state.worldHeight)
+
+        # If the bullet goes towards the target cell, or outside the allowed range, destroy it
+        travelVectors = positions - startPositions
+        targetVectors = endPositions - startPositions
+        travels = np.sqrt(travelVectors[:,0] * travelVectors[:,0] + travelVectors[:,1] * travelVectors[:,1])
+        targetDistances = np.sqrt(targetVectors[:,0] * targetVectors[:,0] + targetVectors[:,1] * targetVectors[:,1])
+        newTravels = travels + state.bulletSpeed
+        destroyed |= newTravels >= targetDistances
+        destroyed |= newTravels >= state.bulletRange
+
+        # Length of the path of the bullets during this epoch
+        lengths = np.minimum(state.bulletSpeed,np.minimum(targetDistances,state.bulletRange) - travels)
+        lengths = np.maximum(lengths,0)
+
+        # If the bullet hits a wall, destroy it
+        blocked, hitBullets, hitUnits = self.traverse(positions + 0.5,directions,lengths)
+        destroyed |= blocked
+        return newPos, destroyed, hitBullets, hitUnits
+
+    def moveScalar(self,count):
+        """
+        Same as moveArrays, one bullet at a time
+        """
+        state = self.state
+        bullets = state.bullets
+        speed = state.bulletSpeed
+        walls = state.wallsBorderGrid.ravel()
+        units = state.unitsBorderGrid.ravel()
+        rowSize = state.wallsBorderGrid.shape[1]
+        newPos = [ ]
+        destroyed = [ ]
+        hitBullets = [ ]
+        hitUnits = [ ]
+        for index, ((x,y),(dirX,dirY),(startX,startY),(endX,endY),owner) in enumerate(zip(
+            bullets.positions[:count].tolist(),
+            bullets.directions[:count].tolist(),
+            bullets.startPositions[:count].tolist(),
+            bullets.endPositions[:count].tolist(),
+            bullets.owners[:count].tolist()
+        )):
+            newX = x + speed * dirX
+            newY = y + speed * dirY
+            newPos.append((newX,newY))
+            travel = math.sqrt((x - startX) * (x - startX) + (y - startY) * (y - startY))
+            targetDistance = math.sqrt((endX - startX) * (endX - startX) + (endY - startY) * (endY - startY))
+            newTravel = travel + speed
+            length = max(min(speed,min(targetDistance,state.bulletRange) - travel),0)
+            blocked, cellUnits = self.traverseSegment(walls,units,rowSize,x + 0.5,y + 0.5,dirX,dirY,length,owner)
+            destroyed.append(
+                newX < 0 or newX >= state.worldWidth or newY < 0 or newY >= state.worldHeight
+                or newTravel >= targetDistance or newTravel >= state.bulletRange or blocked
+            )
+            for unitIndex in cellUnits:
+                hitBullets.append(index)
+                hitUnits.append(unitIndex)
+        return np.array(newPos), np.array(destroyed,dtype=bool), hitBullets, hitUnits
+
+    def traverseSegment(self,walls,units,rowSize,x,y,dirX,dirY,length,owner):
+        """
+        Walk the cells crossed by one segment, as traverse() does for all the 
+        segments (the walls and units grids are the flattened border grids).
+
+        Returns true if the segment crosses a wall or leaves the world, and the
+        indices of the units before this cell (except the owner)
+        """
+        cellX = math.floor(x)
+        cellY = math.floor(y)
+        cell = (cellY + 1) * rowSize + cellX + 1
+        if dirX != 0:
+            stepX = 1 if dirX > 0 else -1
+            deltaX = 1 / abs(dirX)
+            nextX = (1 - (x - cellX) if dirX > 0 else x - cellX) * deltaX
+        else:
+            stepX, deltaX, nextX = 0, math.inf, math.inf
+        if dirY != 0:
+            stepY = rowSize if dirY > 0 else -rowSize
+            deltaY = 1 / abs(dirY)
+            nextY = (1 - (y - cellY) if dirY > 0 else y - cellY) * deltaY
+        else:
+            stepY, deltaY, nextY = 0, math.inf, math.inf
+
+        hitUnits = [ ]
+        while True:
+            if walls[cell]:
+                return True, hitUnits
+            unitIndex = int(units[cell])
+            if unitIndex >= 0 and unitIndex != owner:
+                hitUnits.append(unitIndex)
+            # Most bullets stay in their cell during an epoch
+            if nextX < nextY:
+                if nextX > length:
+                    return False, hitUnits
+                cell += stepX
+                nextX += deltaX
+            else:
+                if nextY > length:
+                    return False, hitUnits
+                cell += stepY
+                nextY += deltaY
+
+    def traverse(self,origins,directions,lengths):
+        """
+        Walk the cells crossed by the segments origins + t * directions, t from 0 
+        to lengths (Amanatides and Woo traversal, one step for all segments at once).
         
+        Returns a mask of the segments that cross a wall or leave the world, and 
+        the bullet and unit indices of the units before these cells (except the 
+        bullet owners), sorted by bullet and then by distance along the segment.
+        """
+        state = self.state
+        walls = state.wallsBorderGrid.ravel()
+        units = state.unitsBorderGrid.ravel()
+        rowSize = state.wallsBorderGrid.shape[1]
+        owners = state.bullets.owners
+        blockedSegments = np.zeros(len(origins),dtype=bool)
+
+        # Cells are indices in the flattened border grids
+        floors = np.floor(origins)
+        cells = (floors[:,1].astype(np.intp) + 1) * rowSize + floors[:,0].astype(np.intp) + 1
+        signs = np.sign(directions).astype(np.intp)
+        stepX = signs[:,0]
+        stepY = signs[:,1] * rowSize
+
+        # Distance along the segment to the next vertical and horizontal cell 
+        # borders (infinite if the segment is parallel to the borders)
+        moving = signs != 0
+        deltas = np.full(directions.shape,np.inf)
+        np.divide(1,np.abs(directions),out=deltas,where=moving)
+        fractions = origins - floors
+        borders = np.where(signs > 0,1 - fractions,fractions)
+        nextBorders = np.full(directions.shape,np.inf)
+        np.multiply(borders,deltas,out=nextBorders,where=moving)
+
+        active = np.arange(len(origins))
+        hitBullets = [ ]
+        hitUnits = [ ]
+        while len(active) > 0:
+            # Walls and world limits stop the bullets
+            blocked = walls[cells]
+            blockedSegments[active[blocked]] = True
+
+            # Units in the cells (always -1 in the border)
+            unitIndices = units[cells]
+            hits = (unitIndices >= 0) & (unitIndices != owners[active]) & ~blocked
+            if hits.any():
+                hitBullets.append(active[hits])
+                hitUnits.append(unitIndices[hits])
+
+            # Next cell, if the segment goes that far
+            alongX = nextBorders[:,0] < nextBorders[:,1]
+            keep = ~blocked & (np.where(alongX,nextBorders[:,0],nextBorders[:,1]) <= lengths)
+            if not keep.any():
+                break
+            active = active[keep]
+            alongX = alongX[keep]
+            lengths = lengths[keep]
+            stepX = stepX[keep]
+            stepY = stepY[keep]
+            deltas = deltas[keep]
+            nextBorders = nextBorders[keep]
+            cells = cells[keep] + np.where(alongX,stepX,stepY)
+            nextBorders[alongX,0] += deltas[alongX,0]
+            alongY = ~alongX
+            nextBorders[alongY,1] += deltas[alongY,1]
+
+        if len(hitBullets) == 0:
+            return blockedSegments, [ ], [ ]
+        hitBullets = np.concatenate(hitBullets)
+        hitUnits = np.concatenate(hitUnits)
+        # Stable sort: cells of a bullet stay in traversal order
+        order = np.argsort(hitBullets,kind='stable')
+        return blockedSegments, hitBullets[order], hitUnits[order]
         
 class LoadLevelCommand(Command):
-    def __init__(self,gameMode,fileName):
+    """
+    This command loads a level in the game state and the game mode layers.
+    
+    The compiled level is used when it is up to date (see levelcache module). 
+    The level can also be given already decoded (see loader module).
+    """
+    def __init__(self,gameMode,fileName,level=None):
         self.gameMode = gameMode
         self.fileName = fileName
+        self.level = level
         
-    def decodeLayer(self,tileMap,layer):
-        """
-        Decode layer and check layer properties
-        
-        Returns the corresponding tileset
-        """
-        if not isinstance(layer,tmx.Layer):
-            raise RuntimeError("Error in {}: invalid layer type".format(self.fileName))
-        if len(layer.tiles) != tileMap.width * tileMap.height:
-            raise RuntimeError("Error in {}: invalid tiles count".format(self.fileName))
-        
-        # Guess which tileset is used by this layer
-        gid = None
-        for tile in layer.tiles:
-            if tile.gid != 0:
-                gid = tile.gid
-                break
-        if gid is None:
-            if len(tileMap.tilesets) == 0:
-                raise RuntimeError("Error in {}: no tilesets".format(self.fileName))
-            tileset = tileMap.tilesets[0]
-        else:
-            tileset = None
-            for t in tileMap.tilesets:
-                if gid >= t.firstgid and gid < t.firstgid+t.tilecount:
-                    tileset = t
-                    break
-            if tileset is None:
-                raise RuntimeError("Error in {}: no corresponding tileset".format(self.fileName))
-            
-        # Check the tileset
-        if tileset.columns <= 0:
-            raise RuntimeError("Error in {}: invalid columns count".format(self.fileName))
-        if tileset.image.data is not None:
-            raise RuntimeError("Error in {}: embedded tileset image is not supported".format(self.fileName))
-            
-        return tileset
-        
-    def decodeArrayLayer(self,tileMap,layer):
+    def setLayerTileset(self,index,cellSize,imageFile):
         """
-        Create an array from a tileMap layer
-        """        
-        tileset = self.decodeLayer(tileMap,layer)
-        
-        array = [ None ] * tileMap.height
-        for y in range(tileMap.height):
-            array[y] = [ None ] * tileMap.width
-            for x in range(tileMap.width):
-                tile = layer.tiles[x + y*tileMap.width]
-                if tile.gid == 0:
-                    continue
-                lid = tile.gid - tileset.firstgid
-                if lid < 0 or lid >= tileset.tilecount:
-                    raise RuntimeError("Error in {}: invalid tile id".format(self.fileName))
-                tileX = lid % tileset.columns
-                tileY = lid // tileset.columns
-                array[y][x] = Vector2(tileX,tileY)
-
-        return tileset, array
-    
-    def decodeUnitsLayer(self,state,tileMap,layer):
+        Set the tileset of a game mode layer, if any (there is none in headless mode)
         """
-        Create a list from a tileMap layer
-        """        
-        tileset = self.decodeLayer(tileMap,layer)
-
-        units = []
-        for y in range(tileMap.height):
-            for x in range(tileMap.width):
-                tile = layer.tiles[x + y*tileMap.width]
-                if tile.gid == 0:
-                    continue
-                lid = tile.gid - tileset.firstgid
-                if lid < 0 or lid >= tileset.tilecount:
-                    raise RuntimeError("Error in {}: invalid tile id".format(self.fileName))
-                tileX = lid % tileset.columns
-                tileY = lid // tileset.columns
-                unit = Unit(state,Vector2(x,y),Vector2(tileX,tileY))
-                units.append(unit)
-
-        return tileset, units
-        
+        layers = self.gameMode.layers
+        if index < len(layers):
+            layers[index].setTileset(cellSize,imageFile)
         
     def run(self):
         # Load map
-        if not os.path.exists(self.fileName):
-            raise RuntimeError("No file {}".format(self.fileName))
-        tileMap = tmx.TileMap.load(self.fileName)
-        
-        # Check main properties
-        if tileMap.orientation != "orthogonal":
-            raise RuntimeError("Error in {}: invalid orientation".format(self.fileName))
-            
-        if len(tileMap.layers) != 5:
-            raise RuntimeError("Error in {}: 5 layers are expected".format(self.fileName))
+        level = self.level
+        if level is None:
+            level = loadLevel(self.fileName)
+        cellSize = level.cellSize
 
         # World size
         state = self.gameMode.gameState
-        state.worldSize = Vector2(tileMap.width,tileMap.height)    
+        state.worldSize = Vector2(level.width,level.height)    
 
         # Ground layer
-        tileset, array = self.decodeArrayLayer(tileMap,tileMap.layers[0])
-        cellSize = Vector2(tileset.tilewidth,tileset.tileheight)
-        state.ground[:] = array
-        imageFile = tileset.image.source
-        self.gameMode.layers[0].setTileset(cellSize,imageFile)
+        state.ground[:] = level.decodeArray(0)
+        self.setLayerTileset(0,cellSize,level.tilesets[0].imageFile)
 
         # Walls layer
-        tileset, array = self.decodeArrayLayer(tileMap,tileMap.layers[1])
-        if tileset.tilewidth != cellSize.x or tileset.tileheight != cellSize.y:
-            raise RuntimeError("Error in {}: tile sizes must be the same in all layers".format(self.fileName))
-        state.walls[:] = array
-        imageFile = tileset.image.source
-        self.gameMode.layers[1].setTileset(cellSize,imageFile)
+        state.walls[:] = level.decodeArray(1)
+        state.rebuildWallsGrid()
+        self.setLayerTileset(1,cellSize,level.tilesets[1].imageFile)
 
         # Units layer
-        tanksTileset, tanks = self.decodeUnitsLayer(state,tileMap,tileMap.layers[2])
-        towersTileset, towers = self.decodeUnitsLayer(state,tileMap,tileMap.layers[3])
-        if tanksTileset != towersTileset:
-            raise RuntimeError("Error in {}: tanks and towers tilesets must be the same".format(self.fileName))
-        if tanksTileset.tilewidth != cellSize.x or tanksTileset.tileheight != cellSize.y:
-            raise RuntimeError("Error in {}: tile sizes must be the same in all layers".format(self.fileName))
+        tanks = [ Unit(state,position,tile,True) for position, tile in level.decodeUnits(2) ]
+        towers = [ Unit(state,position,tile) for position, tile in level.decodeUnits(3) ]
         state.units[:] = tanks + towers
-        cellSize = Vector2(tanksTileset.tilewidth,tanksTileset.tileheight)
-        imageFile = tanksTileset.image.source
-        self.gameMode.layers[2].setTileset(cellSize,imageFile)
+        state.rebuildUnitsGrid()
+        state.visibility.rebuild()
+        self.setLayerTileset(2,cellSize,level.tilesets[2].imageFile)
 
         # Player units
         self.gameMode.playerUnit = tanks[0]      
         
         # Explosions layers
-        tileset, array = self.decodeArrayLayer(tileMap,tileMap.layers[4])
-        if tileset.tilewidth != cellSize.x or tileset.tileheight != cellSize.y:
-            raise RuntimeError("Error in {}: tile sizes must be the same in all layers".format(self.fileName))
         state.bullets.clear()
-        imageFile = tileset.image.source
-        self.gameMode.layers[3].setTileset(cellSize,imageFile)
+        self.setLayerTileset(3,cellSize,level.tilesets[4].imageFile)
         
         # Window
         worldSize = state.worldSize.elementwise() * cellSize
         self.gameMode.notifyWorldSizeChanged(worldSize)
+        self.gameMode.invalidate()
         
         # Resume game
-        self.gameMode.gameOver = False 
\ No newline at end of file
+        self.gameMode.gameOver = False
+        self.gameMode.resetSnapshots()
+
+
+class CommandBatch():
+    """
+    Commands of the same type, stored as lists of arguments.
+    
+    All commands of a batch are run in a loop with a single pooled command object.
+    """
+    def __init__(self,command):
+        self.command = command
+        self.units = [ ]
+        
+    def __len__(self):
+        return len(self.units)
+        
+    def clear(self):
+        self.units.clear()
+        
+    def run(self):
+        raise NotImplementedError()
+        
+class MoveCommandBatch(CommandBatch):
+    def __init__(self,state):
+        super().__init__(MoveCommand(state,None,None))
+        self.moveVectors = [ ]
+        
+    def append(self,unit,moveVector):
+        self.units.append(unit)
+        self.moveVectors.append(moveVector)
+        
+    def clear(self):
+        super().clear()
+        self.moveVectors.clear()
+        
+    def run(self):
+        command = self.command
+        for unit, moveVector in zip(self.units,self.moveVectors):
+            command.unit = unit
+            command.moveVector = moveVector
+            command.run()
+        
+class TargetCommandBatch(CommandBatch):
+    def __init__(self,state):
+        super().__init__(TargetCommand(state,None,None))
+        self.targets = [ ]
+        
+    def append(self,unit,target):
+        self.units.append(unit)
+        self.targets.append(target)
+        
+    def clear(self):
+        super().clear()
+        self.targets.clear()
+        
+    def run(self):
+        command = self.command
+        for unit, target in zip(self.units,self.targets):
+            command.unit = unit
+            command.target = target
+            command.run()
+        
+class ShootCommandBatch(CommandBatch):
+    def __init__(self,state):
+        super().__init__(ShootCommand(state,None))
+        
+    def append(self,unit):
+        self.units.append(unit)
+        
+    def run(self):
+        command = self.command
+        for unit in self.units:
+            command.unit = unit
+            command.run()
+        
+class CommandPipeline():
+    """
+    Commands of the next epoch, grouped in per-type batches.
+    
+    Batches are run in this order: generic commands (for instance level loading), 
+    moves, targets, shots and finally bullets. Within a batch, commands are run in
+    the order they were added. This is the order commands are created by the game 
+    modes: a unit target is always set before the unit shoots, and bullets are 
+    moved after all shots.
+    """
+    def __init__(self,state):
+        self.state = state
+        self.commands = [ ]
+        self.moves = MoveCommandBatch(state)
+        self.targets = TargetCommandBatch(state)
+        self.shots = ShootCommandBatch(state)
+        self.moveBulletsCommand = MoveBulletsCommand(state,0)
+        self.moveBulletsRequested = False
+        
+        # Statistics
+        self.commandCount = 0
+        self.runTime = 0
+        
+    def __len__(self):
+        return len(self.commands) + len(self.moves) + len(self.targets) + len(self.shots) \
+             + (1 if self.moveBulletsRequested else 0)
+        
+    @property
+    def commandsPerSecond(self):
+        if self.runTime <= 0:
+            return 0
+        return self.commandCount / self.runTime
+        
+    def append(self,command):
+        """
+        Add a generic command
+        """
+        self.commands.append(command)
+        
+    def move(self,unit,moveVector):
+        self.moves.append(unit,moveVector)
+        
+    def target(self,unit,target):
+        self.targets.append(unit,target)
+        
+    def shoot(self,unit):
+        self.shots.append(unit)
+        
+    def moveBullets(self,count):
+        """
+        Move the first count bullets, and delete the destroyed ones
+        """
+        self.moveBulletsCommand.count = count
+        self.moveBulletsRequested = True
+        
+    def clear(self):
+        self.commands.clear()
+        self.moves.clear()
+        self.targets.clear()
+        self.shots.clear()
+        self.moveBulletsRequested = False
+        
+    def profile(self,command,count,startTime):
+        if profiler.enabled and startTime is not None:
+            name = type(command).__name__
+            profiler.stop('command',name,startTime)
+            profiler.addCount('count',name,count)
+
+    def run(self):
+        """
+        Run and clear all commands
+        """
+        startTime = time.perf_counter()
+        count = len(self)
+        try:
+            for command in self.commands:
+                commandStartTime = profiler.start()
+                command.run()
+                self.profile(command,1,commandStartTime)
+            for batch in (self.moves,self.targets,self.shots):
+                if len(batch) > 0:
+                    commandStartTime = profiler.start()
+                    batchCount = len(batch)
+                    batch.run()
+                    self.profile(batch.command,batchCount,commandStartTime)
+            if self.moveBulletsRequested:
+                commandStartTime = profiler.start()
+                self.moveBulletsCommand.run()
+                self.profile(self.moveBulletsCommand,1,commandStartTime)
+        finally:
+            self.clear()
+        self.commandCount += count
+        self.runTime += time.perf_counter() - startTime
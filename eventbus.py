@@ -0,0 +1,53 @@
+class EventBus():
+    """
+    Events queued during a tick, and dispatched in one batch at its end.
+
+    An event is a type (a string, for instance 'unitDestroyed') and a payload.
+    Only the events with subscribers are queued, and each subscriber only
+    receives the types it subscribed to. A coalescing subscriber receives all
+    the payloads of the tick in a single call, as a list.
+    """
+    def __init__(self):
+        self.subscribers = { }
+        self.queue = { }
+
+    def subscribe(self,eventType,handler,coalesce=False):
+        """
+        Call handler(payload) for each event of eventType, or handler(payloads)
+        once per dispatch if coalesce is true
+        """
+        if eventType not in self.subscribers:
+            self.subscribers[eventType] = [ ]
+        self.subscribers[eventType].append((handler,coalesce))
+
+    def unsubscribe(self,eventType,handler):
+        subscribers = self.subscribers.get(eventType,[ ])
+        subscribers[:] = [ subscriber for subscriber in subscribers if subscriber[0] != handler ]
+
+    def publish(self,eventType,payload=None):
+        if eventType not in self.subscribers:
+            return
+        if eventType not in self.queue:
+            self.queue[eventType] = [ ]
+        self.queue[eventType].append(payload)
+
+    def clear(self):
+        self.queue = { }
+
+    def dispatch(self):
+        """
+        Send the queued events, type by type in order of first publication.
+
+        Events published by handlers are queued for the next dispatch.
+        """
+        queue = self.queue
+        if len(queue) == 0:
+            return
+        self.queue = { }
+        for eventType, payloads in queue.items():
+            for handler, coalesce in self.subscribers.get(eventType,[ ]):
+                if coalesce:
+                    handler(payloads)
+                else:
+                    for payload in payloads:
+                        handler(payload)
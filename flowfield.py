@@ -0,0 +1,131 @@
+import numpy as np
+from pygame.math import Vector2
+from unit import Status
+
+
+class FlowField():
+    """
+    Shared path finding towards a target cell (the player's unit).
+
+    A breadth-first search over the walls and the blocking units (towers and
+    wrecks, see isBlocking) gives the number of moves from each cell to the
+    target, and each cell gets the direction of its downhill neighbour. Units
+    then follow the directions: the cost per unit is a lookup, and the search
+    is only run again when the target changes cell, or after invalidate()
+    (when a unit is destroyed, or the units are restored). Live tanks move, so
+    they don't block the field.
+
+    The search is limited to maxDistance moves: cells further away have no
+    direction.
+    """
+    # Moves, indexed by direction
+    moves = [ Vector2(1,0), Vector2(-1,0), Vector2(0,1), Vector2(0,-1) ]
+
+    def __init__(self,state,maxDistance=64):
+        self.state = state
+        self.maxDistance = maxDistance
+        self.wallsGrid = None
+        self.target = None
+        self.distances = None
+        self.directions = None
+        self.window = None
+        self.invalid = True
+
+    def invalidate(self):
+        """
+        Run the search again at the next update (the blocking units changed)
+        """
+        self.invalid = True
+
+    @staticmethod
+    def isBlocking(unit):
+        return not unit.mobile or unit.status != Status.ALIVE
+
+    def blockedCells(self,x0,y0,x1,y1):
+        """
+        Returns the mask of the cells occupied by blocking units, in a window of the world
+        """
+        units = self.state.units
+        if len(units) == 0:
+            return np.zeros((y1 - y0,x1 - x0),dtype=bool)
+        blocking = np.array([ self.isBlocking(unit) for unit in units ],dtype=bool)
+        indices = self.state.unitsGrid[y0:y1,x0:x1]
+        return (indices >= 0) & blocking[np.maximum(indices,0)]
+
+    def update(self,targetX,targetY):
+        """
+        Compute the field towards a target cell, if it changed since the last call
+        """
+        if self.target == (targetX,targetY) and self.wallsGrid is self.state.wallsGrid and not self.invalid:
+            return
+        self.target = (targetX,targetY)
+        self.invalid = False
+        height, width = self.state.wallsGrid.shape
+        if self.wallsGrid is not self.state.wallsGrid:
+            self.wallsGrid = self.state.wallsGrid
+            self.distances = np.full((height,width),-1,dtype=np.int32)
+            self.directions = np.full((height,width),-1,dtype=np.int8)
+        elif self.window is not None:
+            # Only the previous search window has to be cleared
+            x0, y0, x1, y1 = self.window
+            self.distances[y0:y1,x0:x1] = -1
+            self.directions[y0:y1,x0:x1] = -1
+        self.window = None
+        if targetX < 0 or targetX >= width or targetY < 0 or targetY >= height:
+            return
+
+        # Search window around the target
+        x0 = max(0,targetX - self.maxDistance)
+        y0 = max(0,targetY - self.maxDistance)
+        x1 = min(width,targetX + self.maxDistance + 1)
+        y1 = min(height,targetY + self.maxDistance + 1)
+        self.window = (x0,y0,x1,y1)
+        free = ~(self.wallsGrid[y0:y1,x0:x1] | self.blockedCells(x0,y0,x1,y1))
+        free[targetY - y0,targetX - x0] = True
+        distances = self.distances[y0:y1,x0:x1]
+
+        # Breadth-first search, one wavefront per distance
+        frontier = np.zeros(free.shape,dtype=bool)
+        frontier[targetY - y0,targetX - x0] = True
+        distances[frontier] = 0
+        for distance in range(1,self.maxDistance + 1):
+            reached = np.zeros(free.shape,dtype=bool)
+            reached[:,1:] |= frontier[:,:-1]
+            reached[:,:-1] |= frontier[:,1:]
+            reached[1:,:] |= frontier[:-1,:]
+            reached[:-1,:] |= frontier[1:,:]
+            reached &= free & (distances < 0)
+            if not reached.any():
+                break
+            distances[reached] = distance
+            frontier = reached
+
+        # Direction of the neighbour with the lowest distance (in moves order)
+        unreachable = np.iinfo(np.int32).max
+        padded = np.full((y1 - y0 + 2,x1 - x0 + 2),unreachable,dtype=np.int32)
+        padded[1:-1,1:-1] = np.where(distances >= 0,distances,unreachable)
+        neighbours = np.stack([
+            padded[1:-1,2:],
+            padded[1:-1,:-2],
+            padded[2:,1:-1],
+            padded[:-2,1:-1]
+        ])
+        best = np.argmin(neighbours,axis=0)
+        bestDistance = np.min(neighbours,axis=0)
+        downhill = (distances > 0) & (bestDistance < distances)
+        self.directions[y0:y1,x0:x1] = np.where(downhill,best,-1)
+
+    def distance(self,x,y):
+        """
+        Returns the number of moves from a cell to the target, or -1 if it is unknown
+        """
+        return int(self.distances[y,x])
+
+    def nextMove(self,x,y):
+        """
+        Returns the move towards the target from a cell, or None
+        """
+        direction = self.directions[y,x]
+        if direction < 0:
+            return None
+        return self.moves[direction]
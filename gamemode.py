@@ -1,12 +1,29 @@
 import pygame
+from collections import Counter
 from gamestate import *
 from layer import *
 from command import *
+from camera import Camera
+from flowfield import FlowField
+from assets import assets
+from profiler import profiler
+from eventbus import EventBus
+from snapshot import Snapshot, SnapshotRing
+from unit import Status
 
 class GameMode():
+    """
+    Base of game modes.
+
+    Notifications are published on the mode event bus, and sent to the 
+    observers at the end of update() (see GameModeObserver).
     
+    Overlay modes set changed when their content must be drawn again: the 
+    user interface keeps the last drawing of an overlay until then.
+    """
     def __init__(self):
-        self.observers = []
+        self.events = EventBus()
+        self.changed = True
 
     def processInput(self):
         raise NotImplementedError()
@@ -14,44 +31,60 @@ class GameMode():
         raise NotImplementedError()
     def render(self, window):
         raise NotImplementedError()
+    def release(self):
+        """
+        Release the assets of this mode
+        """
+        pass
 
     def addObserver(self, observer):
-        self.observers.append(observer)
+        events = self.events
+        events.subscribe('loadLevelRequested', observer.loadLevelRequested)
+        events.subscribe('levelLoaded', observer.levelLoaded)
+        events.subscribe('levelLoadingFailed', observer.levelLoadingFailed)
+        events.subscribe('worldSizeChanged', observer.worldSizeChanged)
+        events.subscribe('showMenuRequested', lambda payload: observer.showMenuRequested())
+        events.subscribe('showGameRequested', lambda payload: observer.showGameRequested())
+        events.subscribe('gameWon', lambda payload: observer.gameWon())
+        events.subscribe('gameLost', lambda payload: observer.gameLost())
+        events.subscribe('quitRequested', lambda payload: observer.quitRequested())
 
     def notifyLoadLevelRequested(self, fileName):
-        for observer in self.observers:
-            observer.loadLevelRequested(fileName)
+        self.events.publish('loadLevelRequested', fileName)
+
+    def notifyLevelLoaded(self, loader):
+        self.events.publish('levelLoaded', loader)
+
+    def notifyLevelLoadingFailed(self, error):
+        self.events.publish('levelLoadingFailed', error)
 
     def notifyWorldSizeChanged(self, worldSize):
-        for observer in self.observers:
-            observer.worldSizeChanged(worldSize)
+        self.events.publish('worldSizeChanged', worldSize)
 
     def notifyShowMenuRequested(self):
-        for observer in self.observers:
-            observer.showMenuRequested()
+        self.events.publish('showMenuRequested')
         
     def notifyShowGameRequested(self):
-        for observer in self.observers:
-            observer.showGameRequested()
+        self.events.publish('showGameRequested')
     
     def notifyGameWon(self):
-        for observer in self.observers:
-            observer.gameWon()
+        self.events.publish('gameWon')
 
     def notifyGameLost(self):
-        for observer in self.observers:
-            observer.gameLost()
+        self.events.publish('gameLost')
 
     def notifyQuitRequested(self):
-        for observer in self.observers:
-            observer.quitRequested()
+        self.events.publish('quitRequested')
 
 class MessageGameMode(GameMode):
     def __init__(self, message):        
         super().__init__()
-        self.font = pygame.font.Font("BD_Cartoon_Shout.ttf", 36)
+        self.font = assets.loadFont("BD_Cartoon_Shout.ttf", 36)
         self.message = message
 
+    def release(self):
+        assets.releaseFont("BD_Cartoon_Shout.ttf", 36)
+
     def processInput(self):
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
@@ -64,21 +97,67 @@ class MessageGameMode(GameMode):
                     self.notifyShowGameRequested()
                     
     def update(self):
-        pass
+        self.events.dispatch()
+        
+    def render(self, window):
+        surface = assets.renderText(self.font, self.message, (200, 0, 0))
+        x = (window.get_width() - surface.get_width()) // 2
+        y = (window.get_height() - surface.get_height()) // 2
+        window.blit(surface, (x, y))
+
+class LoadingGameMode(GameMode):
+    """
+    Overlay shown while a level is loaded in the background (see loader module).
+    
+    When the loader is finished, the mode notifies the level or the error once.
+    """
+    def __init__(self, loader):        
+        super().__init__()
+        self.font = assets.loadFont("BD_Cartoon_Shout.ttf", 36)
+        self.loader = loader
+        self.notified = False
+        self.progress = 0
+
+    def release(self):
+        assets.releaseFont("BD_Cartoon_Shout.ttf", 36)
+
+    def processInput(self):
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                self.notifyQuitRequested()
+                break
+                    
+    def update(self):
+        if self.loader.progress != self.progress:
+            self.progress = self.loader.progress
+            self.changed = True
+        if self.loader.finished and not self.notified:
+            self.notified = True
+            if self.loader.error is not None:
+                self.notifyLevelLoadingFailed(self.loader.error)
+            else:
+                self.notifyLevelLoaded(self.loader)
+        self.events.dispatch()
         
     def render(self, window):
-        surface = self.font.render(self.message, True, (200, 0, 0))
+        surface = assets.renderText(self.font, "Loading...", (200, 0, 0))
         x = (window.get_width() - surface.get_width()) // 2
         y = (window.get_height() - surface.get_height()) // 2
         window.blit(surface, (x, y))
+        
+        # Progress bar
+        width = surface.get_width()
+        y += surface.get_height() + 10
+        pygame.draw.rect(window, (200, 0, 0), (x, y, width, 10), 1)
+        pygame.draw.rect(window, (200, 0, 0), (x, y, int(width * self.progress), 10))
 
 class MenuGameMode(GameMode):
     def __init__(self):        
         super().__init__()
         
         # Font
-        self.titleFont = pygame.font.Font("BD_Cartoon_Shout.ttf", 72)
-        self.itemFont = pygame.font.Font("BD_Cartoon_Shout.ttf", 48)
+        self.titleFont = assets.loadFont("BD_Cartoon_Shout.ttf", 72)
+        self.itemFont = assets.loadFont("BD_Cartoon_Shout.ttf", 48)
         
         # Menu items
         self.menuItems = [
@@ -103,12 +182,17 @@ class MenuGameMode(GameMode):
         # Compute menu width
         self.menuWidth = 0
         for item in self.menuItems:
-            surface = self.itemFont.render(item['title'], True, (200, 0, 0))
+            surface = assets.renderText(self.itemFont, item['title'], (200, 0, 0))
             self.menuWidth = max(self.menuWidth, surface.get_width())
             item['surface'] = surface        
         
         self.currentMenuItem = 0
-        self.menuCursor = pygame.image.load("cursor.png")        
+        self.menuCursor = assets.loadImage("cursor.png")        
+
+    def release(self):
+        assets.releaseFont("BD_Cartoon_Shout.ttf", 72)
+        assets.releaseFont("BD_Cartoon_Shout.ttf", 48)
+        assets.releaseImage("cursor.png")
 
     def processInput(self):
         for event in pygame.event.get():
@@ -121,25 +205,24 @@ class MenuGameMode(GameMode):
                 elif event.key == pygame.K_DOWN:
                     if self.currentMenuItem < len(self.menuItems) - 1:
                         self.currentMenuItem += 1
+                        self.changed = True
                 elif event.key == pygame.K_UP:
                     if self.currentMenuItem > 0:
                         self.currentMenuItem -= 1
+                        self.changed = True
                 elif event.key == pygame.K_RETURN:
                     menuItem = self.menuItems[self.currentMenuItem]
-                    try:
-                        menuItem['action']()
-                    except Exception as ex:
-                        print(ex)
+                    menuItem['action']()
                     
     def update(self):
-        pass
+        self.events.dispatch()
         
     def render(self, window):
         # Initial y
         y = 50
         
         # Title
-        surface = self.titleFont.render("TANK BATTLEGROUNDS !!", True, (200, 0, 0))
+        surface = assets.renderText(self.titleFont, "TANK BATTLEGROUNDS !!", (200, 0, 0))
         x = (window.get_width() - surface.get_width()) // 2
         window.blit(surface, (x, y))
         y += (200 * surface.get_height()) // 100
@@ -161,7 +244,7 @@ class MenuGameMode(GameMode):
             
 
 class PlayGameMode(GameMode):
-    def __init__(self):
+    def __init__(self,headless=False):
         super().__init__()
         
         # Game state
@@ -169,25 +252,52 @@ class PlayGameMode(GameMode):
         
         # Rendering properties
         self.cellSize = Vector2(64,64)        
+        self.camera = Camera(self.cellSize)
 
-        # Layers
-        self.layers = [
-            ArrayLayer(self.cellSize,"ground.png",self.gameState,self.gameState.ground,0),
-            ArrayLayer(self.cellSize,"walls.png",self.gameState,self.gameState.walls),
-            UnitsLayer(self.cellSize,"units.png",self.gameState,self.gameState.units),
-            BulletsLayer(self.cellSize,"explosions.png",self.gameState,self.gameState.bullets),
-            ExplosionsLayer(self.cellSize,"explosions.png"),
-            SoundLayer("170274__knova__rifle-fire-synthetic.wav","110115__ryansnook__small-explosion.wav")
-        ]
+        # Layers (none in headless mode: no rendering and no sound)
+        self.headless = headless
+        self.soundLayer = None
+        if headless:
+            self.layers = [ ]
+        else:
+            explosionsLayer = ExplosionsLayer(self.cellSize,"explosions.png",self.gameState)
+            soundLayer = SoundLayer("170274__knova__rifle-fire-synthetic.wav","110115__ryansnook__small-explosion.wav",lambda: self.playerUnit.position)
+            self.layers = [
+                ArrayLayer(self.cellSize,"ground.png",self.gameState,self.gameState.ground,0),
+                ArrayLayer(self.cellSize,"walls.png",self.gameState,self.gameState.walls),
+                UnitsLayer(self.cellSize,"units.png",self.gameState,self.gameState.units),
+                BulletsLayer(self.cellSize,"explosions.png",self.gameState,self.gameState.bullets),
+                explosionsLayer,
+                soundLayer
+            ]
         
-        # All layers listen to game state events
-        for layer in self.layers:
-            self.gameState.addObserver(layer)
+            # Explosions and sounds listen to game state events (sounds once per epoch)
+            events = self.gameState.events
+            events.subscribe('unitDestroyed',explosionsLayer.unitDestroyed)
+            events.subscribe('unitDestroyed',soundLayer.unitsDestroyed,coalesce=True)
+            events.subscribe('bulletFired',soundLayer.bulletsFired,coalesce=True)
+            self.soundLayer = soundLayer
 
         # Controls
         self.playerUnit = self.gameState.units[0]
         self.gameOver = False
-        self.commands = [ ]
+        self.recorder = None
+        self.flowField = FlowField(self.gameState)
+        self.gameState.events.subscribe('unitDestroyed',lambda units: self.flowField.invalidate(),coalesce=True)
+        self.commands = CommandPipeline(self.gameState)
+
+        # Snapshots: level start (F2), quick save (F5 and F9), and the last 
+        # seconds (backspace rewinds rewindEpochs epochs)
+        self.startSnapshot = None
+        self.quickSnapshot = None
+        self.snapshots = SnapshotRing()
+        self.rewindEpochs = 120
+
+        # Dirty rects rendering (see render())
+        self.dirtyRects = False
+        self.background = None
+        self.backgroundKey = None
+        self.drawnItems = Counter()
         
     @property
     def cellWidth(self):
@@ -197,6 +307,10 @@ class PlayGameMode(GameMode):
     def cellHeight(self):
         return int(self.cellSize.y)
 
+    def release(self):
+        for layer in self.layers:
+            layer.release()
+
     def processInput(self):
         # Pygame events (close, keyboard and mouse click)
         moveVector = Vector2()
@@ -217,64 +331,144 @@ class PlayGameMode(GameMode):
                     moveVector.y = 1
                 elif event.key == pygame.K_UP:
                     moveVector.y = -1
+                elif event.key == pygame.K_F3:
+                    profiler.toggle()
+                elif event.key == pygame.K_F2:
+                    self.restoreSnapshot(self.startSnapshot)
+                elif event.key == pygame.K_F5:
+                    self.quickSnapshot = Snapshot(self.gameState)
+                elif event.key == pygame.K_F9:
+                    self.restoreSnapshot(self.quickSnapshot)
+                elif event.key == pygame.K_BACKSPACE:
+                    self.rewind(self.rewindEpochs)
             elif event.type == pygame.MOUSEBUTTONDOWN:
                 mouseClicked = True
 
+        # Mouse controls the target of the player's unit
+        mousePos = pygame.mouse.get_pos()                    
+        targetCell = self.camera.screenToWorld(mousePos) - Vector2(0.5,0.5)
+
+        self.createCommands(moveVector,targetCell,mouseClicked)
+
+    def createCommands(self,moveVector,targetCell,shoot):
+        """
+        Create the commands of the next epoch from the player's inputs.
+        
+        This is the entry point for any input source (keyboard/mouse, scripts, AI).
+        A targetCell of None keeps the current target of the player's unit.
+        """
+        if self.recorder is not None:
+            self.recorder.record(moveVector,targetCell,shoot)
+
         # If the game is over, all commands creations are disabled
         if self.gameOver:
             return
                     
-        # Keyboard controls the moves of the player's unit
+        self.createUnitCommands(self.playerUnit,moveVector,targetCell,shoot)
+        self.createEnemyCommands([ self.playerUnit ])
+                
+        # Bullets automatic movement, and deletion of destroyed bullets
+        self.commands.moveBullets(len(self.gameState.bullets))
+
+    def createUnitCommands(self,unit,moveVector,targetCell,shoot):
+        """
+        Create the commands of a unit controlled by a player
+        """
+        # Move the unit
         if moveVector.x != 0 or moveVector.y != 0:
-            self.commands.append(
-                MoveCommand(self.gameState,self.playerUnit,moveVector)
-            )
+            self.commands.move(unit,moveVector)
                     
-        # Mouse controls the target of the player's unit
-        mousePos = pygame.mouse.get_pos()                    
-        targetCell = Vector2()
-        targetCell.x = mousePos[0] / self.cellWidth - 0.5
-        targetCell.y = mousePos[1] / self.cellHeight - 0.5
-        command = TargetCommand(self.gameState,self.playerUnit,targetCell)
-        self.commands.append(command)
-
-        # Shoot if left mouse was clicked
-        if mouseClicked:
-            self.commands.append(
-                ShootCommand(self.gameState,self.playerUnit)
-            )
-            self.gameState.notifyBulletFired(self.playerUnit)
-                
-        # Other units always target the player's unit and shoot if close enough
-        for unit in self.gameState.units:
-            if unit != self.playerUnit:
-                self.commands.append(
-                    TargetCommand(self.gameState,unit,self.playerUnit.position)
-                )
-                if unit.position.distance_to(self.playerUnit.position) <= self.gameState.bulletRange:
-                    self.commands.append(
-                        ShootCommand(self.gameState,unit)
-                    )
+        # Target of the unit (only if it changes)
+        if targetCell is not None and targetCell != unit.weaponTarget:
+            self.commands.target(unit,targetCell)
+
+        # Shoot
+        if shoot:
+            self.commands.shoot(unit)
+
+    def createEnemyCommands(self,playerUnits):
+        """
+        Create the commands of the units not controlled by players: they chase
+        and shoot the player's unit
+        """
+        # Enemy tanks chase the player's unit (all of them follow the same flow field)
+        state = self.gameState
+        self.flowField.update(self.playerUnit.cellX,self.playerUnit.cellY)
+        for unit in state.units:
+            if unit.mobile and unit not in playerUnits and unit.status == Status.ALIVE \
+            and state.epoch - unit.lastMoveEpoch >= state.tankMoveDelay:
+                moveVector = self.flowField.nextMove(unit.cellX,unit.cellY)
+                if moveVector is not None:
+                    self.commands.move(unit,moveVector)
                 
-        # Bullets automatic movement
-        for bullet in self.gameState.bullets:
-            self.commands.append(
-                MoveBulletCommand(self.gameState,bullet)
-            )
-            
-        # Delete any destroyed bullet
-        self.commands.append(
-            DeleteDestroyedCommand(self.gameState.bullets)
-        )
-                    
+        # Other units always target the player's unit and shoot if they can see it
+        playerPosition = self.playerUnit.position
+        playerX = self.playerUnit.cellX
+        playerY = self.playerUnit.cellY
+        visibility = state.visibility
+        for unit in state.units:
+            if unit not in playerUnits:
+                if unit.weaponTarget != playerPosition:
+                    self.commands.target(unit,playerPosition)
+                if visibility.canSee(unit,playerX,playerY):
+                    self.commands.shoot(unit)
+
+    def resetSnapshots(self):
+        """
+        Forget the snapshots of the previous level, and take the one of the level start
+        """
+        self.startSnapshot = Snapshot(self.gameState)
+        self.quickSnapshot = None
+        self.snapshots.clear()
+
+    def stopRecording(self):
+        # The inputs after a restore would not replay the same game
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
+
+    def restoreSnapshot(self,snapshot):
+        if snapshot is None:
+            return
+        self.stopRecording()
+        snapshot.restore(self.gameState)
+        self.flowField.invalidate()
+        # The snapshots after the restored one belong to another timeline
+        self.snapshots.clear()
+        self.gameOver = False
+
+    def rewind(self,epochCount):
+        self.stopRecording()
+        if self.snapshots.rewind(self.gameState,epochCount):
+            self.flowField.invalidate()
+            self.gameOver = False
+
     def update(self):
-        for command in self.commands:
-            command.run()
-        self.commands.clear()
+        self.commands.run()
         self.gameState.epoch += 1
+        self.snapshots.record(self.gameState)
+        if profiler.enabled:
+            units = self.gameState.units
+            profiler.setCount('count','units',sum(1 for unit in units if unit.status == Status.ALIVE))
+            profiler.setCount('count','bullets',len(self.gameState.bullets))
+            profiler.addCount('count','epochs',1)
         
-        # Check game over
-        if self.playerUnit.status != "alive":
+        self.checkGameOver()
+
+        # Events of this epoch
+        self.gameState.events.dispatch()
+        self.events.dispatch()
+        self.flushSounds()
+
+    def flushSounds(self):
+        """
+        Play the sounds of the epoch events
+        """
+        if self.soundLayer is not None:
+            self.soundLayer.flush()
+        
+    def checkGameOver(self):
+        if self.playerUnit.status != Status.ALIVE:
             self.gameOver = True
             self.notifyGameLost()
         else:
@@ -282,13 +476,83 @@ class PlayGameMode(GameMode):
             for unit in self.gameState.units:
                 if unit == self.playerUnit:
                     continue
-                if unit.status == "alive":
+                if unit.status == Status.ALIVE:
                     oneEnemyStillLives = True
                     break
             if not oneEnemyStillLives:
                 self.gameOver = True
                 self.notifyGameWon()
+
+    def invalidate(self):
+        """
+        Draw the whole window at the next render (for instance, after something 
+        else was drawn on it)
+        """
+        self.backgroundKey = None
+
+    def renderLayer(self, layer, surface, alpha):
+        startTime = profiler.start()
+        layer.render(surface,self.camera,alpha)
+        profiler.stop('layer',type(layer).__name__,startTime)
+
+    def render(self, window, alpha=1):
+        """
+        Draw the game; alpha from 0 to 1 interpolates moving items between the
+        previous and the current epoch.
         
-    def render(self, window):
+        In dirty rects mode, returns the list of changed screen rects, otherwise
+        None (all the window changed).
+        """
+        # The camera follows the player's unit
+        self.camera.viewSize = Vector2(window.get_size())
+        self.camera.worldSize = self.gameState.worldSize
+        self.camera.follow(self.playerUnit.renderPosition(alpha))
+        if not self.dirtyRects:
+            for layer in self.layers:
+                self.renderLayer(layer,window,alpha)
+            return None
+
+        # Static layers are drawn in the background when the camera moves
+        size = window.get_size()
+        backgroundKey = (int(self.camera.position.x),int(self.camera.position.y),size)
+        redraw = backgroundKey != self.backgroundKey
+        if redraw:
+            if self.background is None or self.background.get_size() != size:
+                self.background = assets.convert(pygame.Surface(size),False)
+            for layer in self.layers:
+                if layer.static:
+                    self.renderLayer(layer,self.background,alpha)
+            self.backgroundKey = backgroundKey
+
+        # Items of the other layers, in drawing order
+        items = [ ]
         for layer in self.layers:
-            layer.render(window)
\ No newline at end of file
+            if not layer.static:
+                layer.items = items
+                self.renderLayer(layer,window,alpha)
+                layer.items = None
+        drawnItems = Counter(items)
+
+        if redraw:
+            window.blit(self.background,(0,0))
+            for x, y, width, height, surface in items:
+                window.blit(surface,(x,y))
+            rects = [ window.get_rect() ]
+        else:
+            # Only the rects of the items that appeared or disappeared are restored,
+            # and the parts of the items inside them are drawn again
+            windowRect = window.get_rect()
+            itemRects = [ pygame.Rect(item[:4]) for item in items ]
+            changedItems = (drawnItems - self.drawnItems) + (self.drawnItems - drawnItems)
+            rects = [ ]
+            for item in changedItems:
+                rect = windowRect.clip(item[:4])
+                if rect.width == 0 or rect.height == 0:
+                    continue
+                window.blit(self.background,rect,rect)
+                for index in rect.collidelistall(itemRects):
+                    clip = rect.clip(itemRects[index])
+                    window.blit(items[index][4],clip,clip.move(-itemRects[index].x,-itemRects[index].y))
+                rects.append(rect)
+        self.drawnItems = drawnItems
+        return rects
@@ -1,17 +1,27 @@
+import numpy as np
 from pygame.math import Vector2
-from unit import Unit
+from unit import Unit, Status
+from bullets import BulletArray
+from visibility import Visibility
+from eventbus import EventBus
 class GameState():
     def __init__(self):
         self.epoch = 0
         self.worldSize = Vector2(16,10)
         self.ground = [ [ Vector2(5,1) ] * 16 ] * 10
         self.walls = [ [ None ] * 16 ] * 10
+        self.wallsGrid = None
+        self.rebuildWallsGrid()
         self.units = [ Unit(self,Vector2(8,9),Vector2(1,0)) ]
-        self.bullets = [ ]
+        self.unitsGrid = None
+        self.rebuildUnitsGrid()
+        self.bullets = BulletArray()
         self.bulletSpeed = 0.1
         self.bulletRange = 4
         self.bulletDelay = 5
-        self.observers = [ ]
+        self.tankMoveDelay = 15
+        self.visibility = Visibility(self)
+        self.events = EventBus()
     
     @property
     def worldWidth(self):
@@ -34,36 +44,81 @@ class GameState():
         return position.x >= 0 and position.x < self.worldWidth \
            and position.y >= 0 and position.y < self.worldHeight
 
+    def rebuildWallsGrid(self):
+        """
+        Rebuild the array of wall cells (True for walls) from the walls layer.
+        
+        wallsGrid is a view inside wallsBorderGrid, which has a border of walls
+        around the world: traversals stop at the world limits without bounds checks.
+        """
+        walls = np.array(
+            [ [ tile is not None for tile in row ] for row in self.walls ],
+            dtype=bool
+        ).reshape((self.worldHeight,self.worldWidth))
+        self.wallsBorderGrid = np.ones((self.worldHeight + 2,self.worldWidth + 2),dtype=bool)
+        self.wallsBorderGrid[1:-1,1:-1] = walls
+        self.wallsGrid = self.wallsBorderGrid[1:-1,1:-1]
+
+    def rebuildUnitsGrid(self):
+        """
+        Rebuild the cell index of the units from the world size and the units list.
+        
+        Each cell contains the index of its unit in the units list, or -1.
+        Destroyed units are also indexed: their wrecks still occupy a cell.
+        As for walls, unitsGrid is a view inside unitsBorderGrid, with a border of -1.
+        """
+        self.unitsBorderGrid = np.full((self.worldHeight + 2,self.worldWidth + 2),-1,dtype=np.int32)
+        self.unitsGrid = self.unitsBorderGrid[1:-1,1:-1]
+        for index, unit in enumerate(self.units):
+            if self.unitsGrid[unit.cellY,unit.cellX] < 0:
+                self.unitsGrid[unit.cellY,unit.cellX] = index
+
+    def unitIndex(self,unit):
+        """
+        Returns the index of a unit in the units list
+        """
+        index = self.unitsGrid[unit.cellY,unit.cellX]
+        if index >= 0 and self.units[index] is unit:
+            return int(index)
+        return self.units.index(unit)
+
+    def moveUnit(self,unit,position):
+        """
+        Move a unit to a new position and keep the cell index in sync.
+        The target cell must be inside the world and free.
+        """
+        index = self.unitIndex(unit)
+        if self.unitsGrid[unit.cellY,unit.cellX] == index:
+            self.unitsGrid[unit.cellY,unit.cellX] = -1
+        unit.position = position
+        unit.cellX = int(position.x)
+        unit.cellY = int(position.y)
+        self.unitsGrid[unit.cellY,unit.cellX] = index
+
     def findUnit(self,position):
         """
-        Returns the index of the first unit at position, otherwise None.
+        Returns the unit in the cell of position, otherwise None.
         """
-        for unit in self.units:
-            if  int(unit.position.x) == int(position.x) \
-            and int(unit.position.y) == int(position.y):
-                return unit
-        return None
+        x = int(position.x)
+        y = int(position.y)
+        if x < 0 or x >= self.worldWidth or y < 0 or y >= self.worldHeight:
+            return None
+        index = self.unitsGrid[y,x]
+        if index < 0:
+            return None
+        return self.units[index]
     
     def findLiveUnit(self,position):
         """
-        Returns the index of the first live unit at position, otherwise None.
+        Returns the live unit in the cell of position, otherwise None.
         """
         unit = self.findUnit(position)
-        if unit is None or unit.status != "alive":
+        if unit is None or unit.status != Status.ALIVE:
             return None
         return unit
     
-    def addObserver(self,observer):
-        """
-        Add a game state observer. 
-        All observer is notified when something happens (see GameStateObserver class)
-        """
-        self.observers.append(observer)
-        
     def notifyUnitDestroyed(self,unit):
-        for observer in self.observers:
-            observer.unitDestroyed(unit)
+        self.events.publish('unitDestroyed',unit)
 
     def notifyBulletFired(self, unit):
-        for observer in self.observers:
-            observer.bulletFired(unit)
+        self.events.publish('bulletFired',unit)
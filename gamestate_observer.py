@@ -1,12 +1,11 @@
-class GameStateObserver():
-    def unitDestroyed(self,unit):
+class GameModeObserver():
+    def loadLevelRequested(self, fileName):
         pass
 
-    def bulletFired(self, unit):
+    def levelLoaded(self, loader):
         pass
 
-class GameModeObserver():
-    def loadLevelRequested(self, fileName):
+    def levelLoadingFailed(self, error):
         pass
 
     def worldSizeChanged(self, worldSize):
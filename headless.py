@@ -0,0 +1,220 @@
+import os
+import sys
+import time
+import random
+import argparse
+from pygame.math import Vector2
+from gamestate_observer import GameModeObserver
+from gamemode import PlayGameMode
+from command import LoadLevelCommand
+from unit import Status
+from profiler import profiler
+
+
+def useDummyDrivers():
+    """
+    Run pygame without display and audio device (unless the drivers are set)
+    """
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+
+
+class PlayerPolicy():
+    """
+    Source of the player's inputs in headless mode
+    """
+    @property
+    def finished(self):
+        """
+        Returns true if the policy has no more inputs (the runner stops)
+        """
+        return False
+
+    def nextInput(self, gameMode):
+        """
+        Returns (moveVector, targetCell, shoot) for the next epoch
+        """
+        raise NotImplementedError()
+
+class IdlePolicy(PlayerPolicy):
+    """
+    The player's unit never moves nor shoots
+    """
+    def nextInput(self, gameMode):
+        return Vector2(), None, False
+
+class AggressivePolicy(PlayerPolicy):
+    """
+    The player's unit stays still, targets the nearest enemy and shoots all the time
+    """
+    def nextInput(self, gameMode):
+        playerUnit = gameMode.playerUnit
+        target = None
+        targetDistance = None
+        for unit in gameMode.gameState.units:
+            if unit is playerUnit or unit.status != Status.ALIVE:
+                continue
+            distance = unit.position.distance_squared_to(playerUnit.position)
+            if target is None or distance < targetDistance:
+                target = unit
+                targetDistance = distance
+        if target is None:
+            return Vector2(), None, False
+        return Vector2(), Vector2(target.position), True
+
+class RandomPolicy(PlayerPolicy):
+    """
+    The player's unit moves, targets and shoots at random
+    """
+    def __init__(self, seed=0, moveRate=0.1, shootRate=0.1):
+        self.random = random.Random(seed)
+        self.moveRate = moveRate
+        self.shootRate = shootRate
+
+    def nextInput(self, gameMode):
+        state = gameMode.gameState
+        moveVector = Vector2()
+        if self.random.random() < self.moveRate:
+            moveVector = self.random.choice([
+                Vector2(1,0), Vector2(-1,0), Vector2(0,1), Vector2(0,-1)
+            ])
+        targetCell = Vector2(
+            self.random.uniform(0, state.worldWidth - 1),
+            self.random.uniform(0, state.worldHeight - 1)
+        )
+        shoot = self.random.random() < self.shootRate
+        return moveVector, targetCell, shoot
+
+class ScriptedPolicy(PlayerPolicy):
+    """
+    Replay a list of (moveVector, targetCell, shoot) inputs, one per epoch,
+    and then stay idle
+    """
+    def __init__(self, inputs):
+        self.inputs = inputs
+        self.index = 0
+
+    def nextInput(self, gameMode):
+        if self.index >= len(self.inputs):
+            return Vector2(), None, False
+        inputs = self.inputs[self.index]
+        self.index += 1
+        return inputs
+
+policies = {
+    'idle': IdlePolicy,
+    'aggressive': AggressivePolicy,
+    'random': RandomPolicy
+}
+
+def createPolicy(name, seed=0):
+    """
+    Create a policy from its name (see policies); the seed is used by random policies
+    """
+    if name not in policies:
+        raise RuntimeError("Unknown policy {}".format(name))
+    if name == 'random':
+        return RandomPolicy(seed)
+    return policies[name]()
+
+
+class HeadlessRunner(GameModeObserver):
+    """
+    Run a level without rendering, sound nor pygame events.
+
+    Each step is one epoch of the game state. By default, steps are run as fast
+    as possible; a ticks per second rate can be set to run at a fixed speed.
+    """
+    def __init__(self, fileName, policy=None):
+        self.fileName = fileName
+        self.policy = IdlePolicy() if policy is None else policy
+        self.winner = None
+        self.elapsedTime = 0
+        self.epochCount = 0
+
+        # Game mode without layers, and level loading
+        self.playGameMode = PlayGameMode(headless=True)
+        self.playGameMode.addObserver(self)
+        self.playGameMode.commands.append(LoadLevelCommand(self.playGameMode,fileName))
+        self.playGameMode.update()
+
+    @property
+    def gameState(self):
+        return self.playGameMode.gameState
+
+    @property
+    def gameOver(self):
+        return self.playGameMode.gameOver
+
+    @property
+    def epochsPerSecond(self):
+        if self.elapsedTime <= 0:
+            return 0
+        return self.epochCount / self.elapsedTime
+
+    def gameWon(self):
+        self.winner = 'player'
+
+    def gameLost(self):
+        self.winner = 'enemies'
+
+    def step(self):
+        """
+        Run one epoch
+        """
+        moveVector, targetCell, shoot = self.policy.nextInput(self.playGameMode)
+        self.playGameMode.createCommands(moveVector, targetCell, shoot)
+        startTime = profiler.start()
+        self.playGameMode.update()
+        profiler.stop('phase','update',startTime)
+        profiler.endFrame()
+        self.epochCount += 1
+
+    def run(self, maxEpochs, ticksPerSecond=None):
+        """
+        Run epochs until the game is over, the policy is finished, or maxEpochs 
+        epochs are run.
+
+        If ticksPerSecond is None, epochs are run as fast as possible.
+        """
+        startTime = time.perf_counter()
+        nextTickTime = startTime
+        while not self.gameOver and not self.policy.finished and self.epochCount < maxEpochs:
+            self.step()
+            if ticksPerSecond is not None:
+                nextTickTime += 1 / ticksPerSecond
+                delay = nextTickTime - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+        self.elapsedTime += time.perf_counter() - startTime
+        return self.winner
+
+
+if __name__ == '__main__':
+    useDummyDrivers()
+
+    parser = argparse.ArgumentParser(description="Run a level without display nor sound")
+    parser.add_argument('level', help="TMX level file")
+    parser.add_argument('--epochs', type=int, default=10000, help="maximum number of epochs")
+    parser.add_argument('--tps', type=float, default=None, help="ticks per second (default: as fast as possible)")
+    parser.add_argument('--policy', choices=sorted(policies.keys()), default='aggressive', help="player's policy")
+    parser.add_argument('--seed', type=int, default=0, help="seed of the random policy")
+    parser.add_argument('--profile', metavar='FILE', help="save the timings of the last epochs (CSV, or JSON if FILE ends with .json)")
+    args = parser.parse_args()
+    if args.profile is not None:
+        profiler.enable()
+
+    policy = createPolicy(args.policy, args.seed)
+    try:
+        runner = HeadlessRunner(args.level, policy)
+        winner = runner.run(args.epochs, args.tps)
+    except Exception as ex:
+        print(ex)
+        sys.exit(1)
+    print("Winner: {}".format(winner if winner is not None else 'none'))
+    print("Epochs: {}".format(runner.epochCount))
+    print("Time: {:.3f} s ({:.0f} epochs/s)".format(runner.elapsedTime, runner.epochsPerSecond))
+    commands = runner.playGameMode.commands
+    print("Commands: {} ({:.0f} commands/s)".format(commands.commandCount, commands.commandsPerSecond))
+    if args.profile is not None:
+        profiler.dump(args.profile)
@@ -1,16 +1,102 @@
 import math
+import numpy as np
 import pygame
+from collections import OrderedDict
 from pygame.math import Vector2
-from gamestate_observer import GameStateObserver
+from assets import assets
+from soundmixer import SoundMixer
+from unit import Status
 
-class Layer(GameStateObserver):
+class RotatedTileCache():
+    """
+    Cache of rotated tiles, keyed by (tileset, tile, quantized angle).
+    
+    Angles are rounded to the closest multiple of angleStep, and the least 
+    recently used tiles are evicted when there are more than maxSize tiles.
+    """
+    def __init__(self,angleStep=3,maxSize=1024):
+        self.angleStep = angleStep
+        self.maxSize = maxSize
+        self.tiles = OrderedDict()
+        
+    def quantizeAngle(self,angle):
+        return (round(angle / self.angleStep) * self.angleStep) % 360
+        
+    def get(self,tileset,tile,angle):
+        """
+        Returns the rotated tile and its offset on screen, knowing that we rotate 
+        around the center of the tile
+        """
+        angle = self.quantizeAngle(angle)
+        key = (tileset,int(tile.x),int(tile.y),angle)
+        item = self.tiles.get(key)
+        if item is not None:
+            self.tiles.move_to_end(key)
+            return item
+        
+        # Extract the tile in a surface
+        tileSurface = tileset.tile(tile)
+        textureTile = pygame.Surface(tileSurface.get_size(),pygame.SRCALPHA)
+        textureTile.blit(tileSurface,(0,0))
+        # Rotate the surface with the tile
+        rotatedTile = assets.convert(pygame.transform.rotate(textureTile,angle))
+        offsetX = (rotatedTile.get_width() - textureTile.get_width()) // 2
+        offsetY = (rotatedTile.get_height() - textureTile.get_height()) // 2
+        
+        item = (rotatedTile,offsetX,offsetY)
+        self.tiles[key] = item
+        if len(self.tiles) > self.maxSize:
+            self.tiles.popitem(last=False)
+        return item
+        
+    def clear(self):
+        self.tiles.clear()
+
+class Layer():
+    """
+    Base of layers.
+    
+    Static layers only change when the camera moves (see PlayGameMode.render). 
+    If items is a list, the other layers do not draw their tiles: they add an
+    item for each tile, its screen rect (x, y, width, height) and its surface,
+    and the game mode draws the items that changed.
+    """
+    # Rotated tiles shared by all layers
+    rotatedTileCache = RotatedTileCache()
+    static = False
+    items = None
+    
     def __init__(self,cellSize,imageFile):
         self.cellSize = cellSize
-        self.texture = pygame.image.load(imageFile)
+        self.imageFile = imageFile
+        self.tileset = assets.loadTileset(imageFile,cellSize)
+        self.texture = self.tileset.texture
+        # Rotated tiles to prepare when the tileset changes: list of (tile, angles)
+        self.rotatedTiles = [ ]
         
     def setTileset(self,cellSize,imageFile):
+        # Load the new tileset before releasing the current one: it is not reloaded if they are the same
+        tileset = assets.loadTileset(imageFile,cellSize)
+        self.release()
         self.cellSize = cellSize
-        self.texture = pygame.image.load(imageFile)
+        self.imageFile = imageFile
+        self.tileset = tileset
+        self.texture = tileset.texture
+        self.warmRotatedTiles()
+        
+    def release(self):
+        """
+        Release the assets of this layer
+        """
+        assets.releaseTileset(self.imageFile,self.cellSize)
+        
+    def warmRotatedTiles(self):
+        """
+        Fill the rotated tiles cache with the tiles of this layer 
+        """
+        for tile, angles in self.rotatedTiles:
+            for angle in angles:
+                self.rotatedTileCache.get(self.tileset,tile,angle)
         
     @property
     def cellWidth(self):
@@ -20,116 +106,225 @@ class Layer(GameStateObserver):
     def cellHeight(self):
         return int(self.cellSize.y)        
     
-    def unitDestroyed(self,unit):
-        pass
-        
-    def renderTile(self,surface,position,tile,angle=None):
-        # Location on screen
+    def renderTile(self,surface,position,tile,angle=None,origin=None):
+        # Location on screen (origin is the world pixel at the top left corner of the surface)
         spritePoint = position.elementwise()*self.cellSize
-        
-        # Texture
-        texturePoint = tile.elementwise()*self.cellSize
-        textureRect = pygame.Rect(int(texturePoint.x), int(texturePoint.y), self.cellWidth, self.cellHeight)
+        if origin is not None:
+            spritePoint -= origin
         
         # Draw
         if angle is None:
-            surface.blit(self.texture,spritePoint,textureRect)
+            tileSurface = self.tileset.tile(tile)
+        else:
+            tileSurface, offsetX, offsetY = self.rotatedTileCache.get(self.tileset,tile,angle)
+            spritePoint.x -= offsetX
+            spritePoint.y -= offsetY
+        if self.items is None:
+            surface.blit(tileSurface,spritePoint)
         else:
-            # Extract the tile in a surface
-            textureTile = pygame.Surface((self.cellWidth,self.cellHeight),pygame.SRCALPHA)
-            textureTile.blit(self.texture,(0,0),textureRect)
-            # Rotate the surface with the tile
-            rotatedTile = pygame.transform.rotate(textureTile,angle)
-            # Compute the new coordinate on the screen, knowing that we rotate around the center of the tile
-            spritePoint.x -= (rotatedTile.get_width() - textureTile.get_width()) // 2
-            spritePoint.y -= (rotatedTile.get_height() - textureTile.get_height()) // 2
-            # Render the rotatedTile
-            surface.blit(rotatedTile,spritePoint)
-
-    def render(self,surface):
+            rect = pygame.Rect(spritePoint,tileSurface.get_size())
+            self.items.append((rect.x,rect.y,rect.width,rect.height,tileSurface))
+
+    def render(self,surface,camera,alpha):
+        """
+        Draw the layer seen by the camera; alpha from 0 to 1 interpolates moving 
+        items between the previous and the current epoch
+        """
         raise NotImplementedError() 
     
 class ArrayLayer(Layer):
-    def __init__(self,ui,imageFile,gameState,array,surfaceFlags=pygame.SRCALPHA):
+    """
+    Static layer baked in chunks of chunkSize x chunkSize cells.
+    
+    Only chunks visible by the camera are baked and rendered, and the least 
+    recently used chunks are dropped beyond maxChunks.
+    """
+    static = True
+
+    def __init__(self,ui,imageFile,gameState,array,surfaceFlags=pygame.SRCALPHA,chunkSize=16,maxChunks=64):
         super().__init__(ui,imageFile)
         self.gameState = gameState
         self.array = array
-        self.surface = None
         self.surfaceFlags = surfaceFlags
+        self.chunkSize = chunkSize
+        self.maxChunks = maxChunks
+        self.chunks = OrderedDict()
         
     def setTileset(self,cellSize,imageFile):
         super().setTileset(cellSize,imageFile)
-        self.surface = None
-        
-    def render(self,surface):
-        if self.surface is None:
-            self.surface = pygame.Surface(surface.get_size(),flags=self.surfaceFlags)
-            for y in range(self.gameState.worldHeight):
-                for x in range(self.gameState.worldWidth):
-                    tile = self.array[y][x]
-                    if not tile is None:
-                        self.renderTile(self.surface,Vector2(x,y),tile)
-        surface.blit(self.surface,(0,0))
+        self.chunks.clear()
+        
+    def bakeChunk(self,chunkX,chunkY):
+        x0 = chunkX * self.chunkSize
+        y0 = chunkY * self.chunkSize
+        x1 = min(x0 + self.chunkSize,self.gameState.worldWidth)
+        y1 = min(y0 + self.chunkSize,self.gameState.worldHeight)
+        size = ((x1 - x0) * self.cellWidth,(y1 - y0) * self.cellHeight)
+        chunk = pygame.Surface(size,flags=self.surfaceFlags)
+        chunk = assets.convert(chunk,self.surfaceFlags & pygame.SRCALPHA != 0)
+        for y in range(y0,y1):
+            for x in range(x0,x1):
+                tile = self.array[y][x]
+                if not tile is None:
+                    self.renderTile(chunk,Vector2(x - x0,y - y0),tile)
+        return chunk
+        
+    def getChunk(self,chunkX,chunkY):
+        key = (chunkX,chunkY)
+        chunk = self.chunks.get(key)
+        if chunk is None:
+            chunk = self.bakeChunk(chunkX,chunkY)
+            self.chunks[key] = chunk
+            if len(self.chunks) > self.maxChunks:
+                self.chunks.popitem(last=False)
+        else:
+            self.chunks.move_to_end(key)
+        return chunk
+        
+    def render(self,surface,camera,alpha):
+        x0, y0, x1, y1 = camera.visibleCells()
+        for chunkY in range(y0 // self.chunkSize,(y1 - 1) // self.chunkSize + 1):
+            for chunkX in range(x0 // self.chunkSize,(x1 - 1) // self.chunkSize + 1):
+                chunk = self.getChunk(chunkX,chunkY)
+                chunkPoint = Vector2(chunkX,chunkY) * self.chunkSize
+                surface.blit(chunk,camera.worldToScreen(chunkPoint))
 
 class UnitsLayer(Layer):
     def __init__(self,ui,imageFile,gameState,units):
         super().__init__(ui,imageFile)
         self.gameState = gameState
         self.units = units
+        # Turret at any angle
+        angleStep = self.rotatedTileCache.angleStep
+        self.rotatedTiles.append(
+            (Vector2(0,6),[ i * angleStep for i in range(int(360 // angleStep)) ])
+        )
         
-    def render(self,surface):
-        for unit in self.units:
-            self.renderTile(surface,unit.position,unit.tile,unit.orientation)
-            if unit.status == "alive":
-                size = unit.weaponTarget - unit.position
+    def render(self,surface,camera,alpha):
+        # Units in the visible cells (with a margin for rotated sprites)
+        x0, y0, x1, y1 = camera.visibleCells(1)
+        indices = self.gameState.unitsGrid[y0:y1,x0:x1]
+        for index in indices[indices >= 0]:
+            unit = self.units[index]
+            position = unit.renderPosition(alpha)
+            self.renderTile(surface,position,unit.tile,unit.orientation,camera.position)
+            if unit.status == Status.ALIVE:
+                size = unit.weaponTarget - position
                 angle = math.atan2(-size.x,-size.y) * 180 / math.pi
-                self.renderTile(surface,unit.position,Vector2(0,6),angle)
+                self.renderTile(surface,position,Vector2(0,6),angle,camera.position)
                 
 class BulletsLayer(Layer):
     def __init__(self,ui,imageFile,gameState,bullets):
         super().__init__(ui,imageFile)
         self.gameState = gameState
         self.bullets = bullets
+        self.rotatedTiles.append(
+            (Vector2(2,1),[0])
+        )
         
-    def render(self,surface):
-        for bullet in self.bullets:
-            if bullet.status == "alive":
-                self.renderTile(surface,bullet.position,bullet.tile,bullet.orientation)
+    def render(self,surface,camera,alpha):
+        # Bullets in the visible cells
+        x0, y0, x1, y1 = camera.visibleCells(1)
+        positions = self.bullets.renderPositions(alpha)
+        visible = (positions[:,0] >= x0) & (positions[:,0] < x1) \
+                & (positions[:,1] >= y0) & (positions[:,1] < y1)
+        tile = Vector2(2,1)
+        for x, y in positions[visible]:
+            self.renderTile(surface,Vector2(x,y),tile,0,camera.position)
                 
 class ExplosionsLayer(Layer):
-    def __init__(self,ui,imageFile):
+    """
+    Explosions animated at the rate of the game epochs, stored in a pool of 
+    capacity slots (numpy arrays).
+
+    Dead slots are reused, and the oldest explosion is replaced when all the 
+    slots are used.
+    """
+    def __init__(self,ui,imageFile,gameState,capacity=256,epochsPerFrame=2):
         super().__init__(ui,imageFile)
-        self.explosions = []
+        self.gameState = gameState
+        self.epochsPerFrame = epochsPerFrame
         self.maxFrameIndex = 27
-        
+        # Tile of each frame of the animation
+        self.frameTiles = [ Vector2(frameIndex,4) for frameIndex in range(self.maxFrameIndex) ]
+        # Pool
+        self.positions = np.zeros((capacity,2),dtype=np.float32)
+        self.startEpochs = np.zeros(capacity,dtype=np.int64)
+        self.alive = np.zeros(capacity,dtype=bool)
+
+    @property
+    def capacity(self):
+        return len(self.alive)
+
     def add(self,position):
-        self.explosions.append({
-            'position': position,
-            'frameIndex': 0
-        })
+        free = np.flatnonzero(~self.alive)
+        if len(free) > 0:
+            index = free[0]
+        else:
+            index = np.argmin(self.startEpochs)
+        self.positions[index] = (position.x,position.y)
+        self.startEpochs[index] = self.gameState.epoch
+        self.alive[index] = True
+
+    def clear(self):
+        self.alive[:] = False
 
     def unitDestroyed(self,unit):
         self.add(unit.position)
         
-    def render(self,surface):
-        for explosion in self.explosions:
-            frameIndex = math.floor(explosion['frameIndex'])
-            self.renderTile(surface,explosion['position'],Vector2(frameIndex,4))
-            explosion['frameIndex'] += 0.5
-        self.explosions = [ explosion for explosion in self.explosions if explosion['frameIndex'] < self.maxFrameIndex ]
+    def render(self,surface,camera,alpha):
+        # Frame of each explosion (ended or future ones, after a rewind, are dead)
+        ages = (self.gameState.epoch - self.startEpochs) + alpha
+        frameIndices = np.floor(ages / self.epochsPerFrame).astype(np.int64)
+        self.alive &= (frameIndices >= 0) & (frameIndices < self.maxFrameIndex)
+
+        # Explosions in the visible cells
+        x0, y0, x1, y1 = camera.visibleCells(1)
+        positions = self.positions
+        visible = self.alive \
+                & (positions[:,0] >= x0) & (positions[:,0] < x1) \
+                & (positions[:,1] >= y0) & (positions[:,1] < y1)
+        for index in np.flatnonzero(visible):
+            x, y = positions[index]
+            self.renderTile(surface,Vector2(float(x),float(y)),self.frameTiles[frameIndices[index]],None,camera.position)
 
 class SoundLayer(Layer):
-    def __init__(self, fireFile, explosionFile):
-        self.fireSound = pygame.mixer.Sound(fireFile)
+    """
+    Sounds of the game events, played by a voice-limited mixer.
+
+    listener is a function that returns the world position sounds are heard 
+    from (the player's unit).
+    """
+    def __init__(self, fireFile, explosionFile, listener=None):
+        self.fireFile = fireFile
+        self.fireSound = assets.loadSound(fireFile)
         self.fireSound.set_volume(0.2)
-        self.explosionSound = pygame.mixer.Sound(explosionFile)
+        self.explosionFile = explosionFile
+        self.explosionSound = assets.loadSound(explosionFile)
         self.explosionSound.set_volume(0.2)
+        self.listener = listener
+        self.mixer = SoundMixer()
+        self.mixer.addSound('fire', self.fireSound, 3)
+        self.mixer.addSound('explosion', self.explosionSound, 4)
+
+    def release(self):
+        self.mixer.stop()
+        assets.releaseSound(self.fireFile)
+        assets.releaseSound(self.explosionFile)
 
-    def unitDestroyed(self, unit):
-        self.explosionSound.play()
+    def unitsDestroyed(self, units):
+        for unit in units:
+            self.mixer.play('explosion', unit.position)
 
-    def bulletFired(self, unit):
-        self.fireSound.play()
+    def bulletsFired(self, units):
+        for unit in units:
+            self.mixer.play('fire', unit.position)
        
-    def render(self, surface):
-        pass
\ No newline at end of file
+    def flush(self):
+        """
+        Play the sounds requested during the epoch (called at its end)
+        """
+        self.mixer.flush(None if self.listener is None else self.listener())
+
+    def render(self, surface, camera, alpha):
+        pass
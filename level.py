@@ -0,0 +1,149 @@
+import os
+import numpy as np
+import tmx
+from pygame.math import Vector2
+
+
+class LevelTileset():
+    """
+    Tileset properties used by a level layer
+    """
+    def __init__(self,firstgid,imageFile,tileWidth,tileHeight,columns,tileCount):
+        self.firstgid = firstgid
+        self.imageFile = imageFile
+        self.tileWidth = tileWidth
+        self.tileHeight = tileHeight
+        self.columns = columns
+        self.tileCount = tileCount
+
+    @property
+    def cellSize(self):
+        return Vector2(self.tileWidth,self.tileHeight)
+
+    def tiles(self):
+        """
+        Returns the texture coordinates of all tiles, indexed by tile id
+        """
+        return [ Vector2(tileId % self.columns,tileId // self.columns) for tileId in range(self.tileCount) ]
+
+
+class Level():
+    """
+    Decoded level, ready to be loaded in a game state.
+
+    There are 5 layers (ground, walls, tanks, towers and explosions), each one
+    with a tileset and an array of tile ids with -1 for empty cells.
+    """
+    layerCount = 5
+
+    def __init__(self,width,height,tilesets,tileIds):
+        self.width = width
+        self.height = height
+        self.tilesets = tilesets
+        self.tileIds = tileIds
+
+    @property
+    def cellSize(self):
+        return self.tilesets[0].cellSize
+
+    def decodeArray(self,layerIndex):
+        """
+        Returns a 2D list with the texture coordinates of the tile of each cell, or None
+        """
+        tiles = self.tilesets[layerIndex].tiles() + [ None ]
+        return [ [ tiles[tileId] for tileId in row ] for row in self.tileIds[layerIndex].tolist() ]
+
+    def decodeUnits(self,layerIndex):
+        """
+        Returns a list of (position, tile) for each non empty cell, in row order
+        """
+        tiles = self.tilesets[layerIndex].tiles()
+        tileIds = self.tileIds[layerIndex]
+        units = []
+        for y, x in np.argwhere(tileIds >= 0).tolist():
+            units.append((Vector2(x,y),Vector2(tiles[tileIds[y,x]])))
+        return units
+
+
+def decodeTmxLayer(fileName,tileMap,layer):
+    """
+    Decode layer and check layer properties
+
+    Returns the corresponding tileset and the array of tile ids
+    """
+    if not isinstance(layer,tmx.Layer):
+        raise RuntimeError("Error in {}: invalid layer type".format(fileName))
+    if len(layer.tiles) != tileMap.width * tileMap.height:
+        raise RuntimeError("Error in {}: invalid tiles count".format(fileName))
+
+    # Guess which tileset is used by this layer
+    gid = None
+    for tile in layer.tiles:
+        if tile.gid != 0:
+            gid = tile.gid
+            break
+    if gid is None:
+        if len(tileMap.tilesets) == 0:
+            raise RuntimeError("Error in {}: no tilesets".format(fileName))
+        tileset = tileMap.tilesets[0]
+    else:
+        tileset = None
+        for t in tileMap.tilesets:
+            if gid >= t.firstgid and gid < t.firstgid+t.tilecount:
+                tileset = t
+                break
+        if tileset is None:
+            raise RuntimeError("Error in {}: no corresponding tileset".format(fileName))
+
+    # Check the tileset
+    if tileset.columns <= 0:
+        raise RuntimeError("Error in {}: invalid columns count".format(fileName))
+    if tileset.image.data is not None:
+        raise RuntimeError("Error in {}: embedded tileset image is not supported".format(fileName))
+
+    # Tile ids
+    gids = np.array([ tile.gid for tile in layer.tiles ],dtype=np.int32)
+    tileIds = gids - tileset.firstgid
+    tileIds[gids == 0] = -1
+    if np.any((gids != 0) & ((tileIds < 0) | (tileIds >= tileset.tilecount))):
+        raise RuntimeError("Error in {}: invalid tile id".format(fileName))
+    tileIds = tileIds.reshape((tileMap.height,tileMap.width))
+
+    levelTileset = LevelTileset(
+        tileset.firstgid,tileset.image.source,
+        tileset.tilewidth,tileset.tileheight,
+        tileset.columns,tileset.tilecount
+    )
+    return levelTileset, tileIds
+
+
+def loadTmxLevel(fileName):
+    """
+    Load and check a TMX level
+    """
+    if not os.path.exists(fileName):
+        raise RuntimeError("No file {}".format(fileName))
+    tileMap = tmx.TileMap.load(fileName)
+
+    # Check main properties
+    if tileMap.orientation != "orthogonal":
+        raise RuntimeError("Error in {}: invalid orientation".format(fileName))
+    if len(tileMap.layers) != Level.layerCount:
+        raise RuntimeError("Error in {}: 5 layers are expected".format(fileName))
+
+    # Layers
+    tilesets = []
+    tileIds = []
+    for layer in tileMap.layers:
+        tileset, ids = decodeTmxLayer(fileName,tileMap,layer)
+        tilesets.append(tileset)
+        tileIds.append(ids)
+
+    # All layers have the same tile size, and units share the same tileset
+    for tileset in tilesets[1:]:
+        if tileset.tileWidth != tilesets[0].tileWidth or tileset.tileHeight != tilesets[0].tileHeight:
+            raise RuntimeError("Error in {}: tile sizes must be the same in all layers".format(fileName))
+    if tilesets[2].firstgid != tilesets[3].firstgid:
+        raise RuntimeError("Error in {}: tanks and towers tilesets must be the same".format(fileName))
+
+    return Level(tileMap.width,tileMap.height,tilesets,tileIds)
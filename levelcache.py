@@ -0,0 +1,171 @@
+import os
+import sys
+import json
+import struct
+import hashlib
+import argparse
+import numpy as np
+from level import Level, LevelTileset, loadTmxLevel
+
+# File layout: magic, version and header size, then a JSON header, and then the
+# tile ids of the 5 layers as int32 arrays (aligned on 16 bytes).
+magic = b'TKLV'
+version = 1
+prefixFormat = '<4sII'
+alignment = 16
+
+
+def cacheFileName(fileName):
+    """
+    Returns the compiled level file name of a TMX file
+    """
+    return fileName + 'c'
+
+def sourceHash(fileName):
+    with open(fileName,'rb') as file:
+        return hashlib.sha1(file.read()).hexdigest()
+
+def compileLevel(fileName,cacheFile=None):
+    """
+    Decode a TMX level and save it in the compiled format
+
+    Returns the decoded level
+    """
+    if cacheFile is None:
+        cacheFile = cacheFileName(fileName)
+    level = loadTmxLevel(fileName)
+    stat = os.stat(fileName)
+    header = {
+        'sourceMTime': stat.st_mtime_ns,
+        'sourceSize': stat.st_size,
+        'sourceHash': sourceHash(fileName),
+        'width': level.width,
+        'height': level.height,
+        'tilesets': [
+            {
+                'firstgid': tileset.firstgid,
+                'imageFile': tileset.imageFile,
+                'tileWidth': tileset.tileWidth,
+                'tileHeight': tileset.tileHeight,
+                'columns': tileset.columns,
+                'tileCount': tileset.tileCount
+            }
+            for tileset in level.tilesets
+        ]
+    }
+    tileData = b''.join(np.ascontiguousarray(tileIds,dtype='<i4').tobytes() for tileIds in level.tileIds)
+    writeCompiledLevel(cacheFile,header,tileData)
+    return level
+
+def writeCompiledLevel(cacheFile,header,tileData):
+    """
+    Save a header and the tile ids (bytes) in a compiled level file
+    """
+    headerData = json.dumps(header).encode('utf-8')
+    dataOffset = struct.calcsize(prefixFormat) + len(headerData)
+    padding = -dataOffset % alignment
+
+    # Write in a temporary file first, so a partial file is never used (even with concurrent processes)
+    tempFile = '{}.{}.tmp'.format(cacheFile,os.getpid())
+    try:
+        with open(tempFile,'wb') as file:
+            file.write(struct.pack(prefixFormat,magic,version,len(headerData) + padding))
+            file.write(headerData)
+            file.write(b' ' * padding)
+            file.write(tileData)
+        os.replace(tempFile,cacheFile)
+    except OSError:
+        # The cache file can't be replaced (memory-mapped on Windows, ...)
+        if os.path.exists(tempFile):
+            os.remove(tempFile)
+        raise
+
+def readHeader(cacheFile):
+    """
+    Returns the header and the offset of the tile ids, or None if the file is not a compiled level
+    """
+    prefixSize = struct.calcsize(prefixFormat)
+    with open(cacheFile,'rb') as file:
+        prefix = file.read(prefixSize)
+        if len(prefix) != prefixSize:
+            return None
+        fileMagic, fileVersion, headerSize = struct.unpack(prefixFormat,prefix)
+        if fileMagic != magic or fileVersion != version:
+            return None
+        header = json.loads(file.read(headerSize).decode('utf-8'))
+    return header, prefixSize + headerSize
+
+def isValid(cacheFile,header,dataOffset,fileName):
+    """
+    Returns true if the compiled level corresponds to the current TMX file
+
+    When only the date or the size of the TMX file changed (same content), the
+    header is updated, so the file is not hashed again by the next loads.
+    """
+    stat = os.stat(fileName)
+    if header['sourceMTime'] == stat.st_mtime_ns and header['sourceSize'] == stat.st_size:
+        return True
+    if header['sourceHash'] != sourceHash(fileName):
+        return False
+    header['sourceMTime'] = stat.st_mtime_ns
+    header['sourceSize'] = stat.st_size
+    with open(cacheFile,'rb') as file:
+        file.seek(dataOffset)
+        tileData = file.read()
+    try:
+        writeCompiledLevel(cacheFile,header,tileData)
+    except OSError:
+        # The compiled file can't be written (read-only folder, ...), it is still valid
+        pass
+    return True
+
+def loadCompiledLevel(cacheFile,header,dataOffset):
+    """
+    Memory-map the tile ids of a compiled level
+    """
+    width = header['width']
+    height = header['height']
+    tilesets = [
+        LevelTileset(
+            t['firstgid'],t['imageFile'],
+            t['tileWidth'],t['tileHeight'],
+            t['columns'],t['tileCount']
+        )
+        for t in header['tilesets']
+    ]
+    array = np.memmap(cacheFile,dtype='<i4',mode='r',offset=dataOffset,shape=(Level.layerCount,height,width))
+    return Level(width,height,tilesets,list(array))
+
+def loadLevel(fileName):
+    """
+    Load a level from its compiled file if it is up to date, otherwise from the
+    TMX file, and then update the compiled file.
+    """
+    if not os.path.exists(fileName):
+        raise RuntimeError("No file {}".format(fileName))
+    cacheFile = cacheFileName(fileName)
+    try:
+        result = readHeader(cacheFile)
+        if result is not None and isValid(cacheFile,*result,fileName):
+            # Read the header again, it may have been updated
+            return loadCompiledLevel(cacheFile,*readHeader(cacheFile))
+    except (OSError,ValueError,KeyError):
+        pass
+    try:
+        return compileLevel(fileName,cacheFile)
+    except OSError:
+        # The compiled file can't be written (read-only folder, ...)
+        return loadTmxLevel(fileName)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compile TMX levels")
+    parser.add_argument('levels', nargs='+', help="TMX level files")
+    args = parser.parse_args()
+    for fileName in args.levels:
+        try:
+            compileLevel(fileName)
+            print("{} -> {}".format(fileName,cacheFileName(fileName)))
+        except Exception as ex:
+            print(ex)
+            sys.exit(1)
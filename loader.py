@@ -0,0 +1,93 @@
+import threading
+import pygame
+from levelcache import loadLevel
+
+
+class Loader():
+    """
+    Files read and decoded in a worker thread.
+
+    The main loop polls finished and progress; results must only be used by
+    the main thread once finished is true. If loading fails, error is the
+    exception.
+    """
+    def __init__(self):
+        self.progress = 0
+        self.error = None
+        self.finishedEvent = threading.Event()
+        self.thread = threading.Thread(target=self.run,daemon=True)
+
+    @property
+    def finished(self):
+        return self.finishedEvent.is_set()
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def wait(self,timeout=None):
+        return self.finishedEvent.wait(timeout)
+
+    def run(self):
+        try:
+            self.load()
+        except Exception as ex:
+            self.error = ex
+        finally:
+            self.progress = 1
+            self.finishedEvent.set()
+
+    def load(self):
+        raise NotImplementedError()
+
+
+def readFile(fileName):
+    with open(fileName,'rb') as file:
+        return file.read()
+
+
+class MusicLoader(Loader):
+    """
+    Read music files in memory (see musics), so they can be played without disk access
+    """
+    def __init__(self,fileNames):
+        super().__init__()
+        self.fileNames = fileNames
+        self.musics = { }
+
+    def load(self):
+        for index, fileName in enumerate(self.fileNames):
+            self.musics[fileName] = readFile(fileName)
+            self.progress = (index + 1) / len(self.fileNames)
+
+
+class LevelLoader(Loader):
+    """
+    Decode a level (see levelcache module), the images of its tilesets and its
+    music.
+
+    images can be given to the asset manager (see AssetManager.preloadImage),
+    and the level to LoadLevelCommand.
+    """
+    def __init__(self,fileName,musicFileName=None):
+        super().__init__()
+        self.fileName = fileName
+        self.musicFileName = musicFileName
+        self.level = None
+        self.images = { }
+        self.music = None
+
+    def load(self):
+        level = loadLevel(self.fileName)
+        imageFiles = [ ]
+        for tileset in level.tilesets:
+            if tileset.imageFile not in imageFiles:
+                imageFiles.append(tileset.imageFile)
+        stepCount = len(imageFiles) + 2
+        self.progress = 1 / stepCount
+        for index, imageFile in enumerate(imageFiles):
+            self.images[imageFile] = pygame.image.load(imageFile)
+            self.progress = (index + 2) / stepCount
+        if self.musicFileName is not None:
+            self.music = readFile(self.musicFileName)
+        self.level = level
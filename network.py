@@ -0,0 +1,779 @@
+import sys
+import math
+import time
+import random
+import socket
+import struct
+import argparse
+import numpy as np
+from collections import OrderedDict
+from pygame.math import Vector2
+from gamemode import PlayGameMode
+from command import LoadLevelCommand
+from unit import Unit, Status
+from headless import useDummyDrivers
+
+# Messages are sent with their length (lengthFormat), and start with their type:
+# - welcomeMessage (server): player index and count, unit index and count, and
+#   the level file name
+# - stateMessage (server): state of an epoch, as a delta from an acknowledged
+#   epoch (see ReplicatedState), followed by the arrays of the delta
+# - inputMessage (client): last received epoch, and inputs of the player
+lengthFormat = '<I'
+welcomeMessage = 1
+stateMessage = 2
+inputMessage = 3
+welcomeFormat = '<BBBHHH'
+stateFormat = '<BqqBHHII'
+inputFormat = '<Bqbbbff'
+shootFlag = 1
+targetFlag = 2
+
+# Game status
+running = 0
+won = 1
+lost = 2
+
+# Quantization: positions in 1/64 cell (int16), directions as int16,
+# angles in 1/256 turn (uint8)
+positionScale = 64
+directionScale = 32767
+angleScale = 256 / 360
+
+
+def checkReplicationLimits(state):
+    """
+    Raise an error if a game state can't be replicated: positions are sent in
+    int16, unit counts and indices in uint16
+    """
+    maxPosition = np.iinfo(np.int16).max
+    if state.worldWidth * positionScale > maxPosition or state.worldHeight * positionScale > maxPosition:
+        raise RuntimeError("Error in server: the level is too large ({}x{} cells, {} at most)".format(
+            state.worldWidth,state.worldHeight,maxPosition // positionScale
+        ))
+    maxUnitCount = np.iinfo(np.uint16).max
+    if len(state.units) > maxUnitCount:
+        raise RuntimeError("Error in server: too many units ({}, {} at most)".format(len(state.units),maxUnitCount))
+
+def addPlayerUnits(state,playerCount):
+    """
+    Add the tanks of the players after the first one (the first tank of the
+    level), in the free cells closest to it. Returns the player units.
+
+    The units are always added in the same order, so clients can do the same.
+    """
+    tanks = [ unit for unit in state.units if unit.mobile ]
+    if len(tanks) == 0:
+        raise RuntimeError("Error in level: there is no tank")
+    firstUnit = tanks[0]
+    playerUnits = [ firstUnit ]
+    if playerCount == 1:
+        return playerUnits
+    # Free cells, closest first
+    free = ~state.wallsGrid & (state.unitsGrid < 0)
+    cellsY, cellsX = np.nonzero(free)
+    distances = np.abs(cellsX - firstUnit.cellX) + np.abs(cellsY - firstUnit.cellY)
+    order = np.lexsort((cellsX,cellsY,distances))
+    if len(order) < playerCount - 1:
+        raise RuntimeError("Error in level: there is not enough space for {} players".format(playerCount))
+    for cellIndex in order[:playerCount - 1]:
+        position = Vector2(int(cellsX[cellIndex]),int(cellsY[cellIndex]))
+        unit = Unit(state,position,Vector2(firstUnit.tile),True)
+        state.units.append(unit)
+        state.unitsGrid[unit.cellY,unit.cellX] = len(state.units) - 1
+        playerUnits.append(unit)
+    return playerUnits
+
+
+class Connection():
+    """
+    Messages sent and received on a non blocking TCP socket.
+
+    Messages are kept in buffers until the socket can send them, or until they
+    are complete.
+    """
+    def __init__(self,sock):
+        self.socket = sock
+        self.socket.setblocking(False)
+        self.socket.setsockopt(socket.IPPROTO_TCP,socket.TCP_NODELAY,1)
+        self.inData = bytearray()
+        self.outData = bytearray()
+        self.closed = False
+        self.bytesSent = 0
+        self.bytesReceived = 0
+
+    @property
+    def pendingSize(self):
+        """
+        Returns the number of bytes waiting to be sent
+        """
+        return len(self.outData)
+
+    def send(self,message):
+        self.outData += struct.pack(lengthFormat,len(message))
+        self.outData += message
+        self.flush()
+
+    def flush(self):
+        if self.closed or len(self.outData) == 0:
+            return
+        try:
+            sent = self.socket.send(self.outData)
+        except BlockingIOError:
+            return
+        except OSError:
+            self.close()
+            return
+        del self.outData[:sent]
+        self.bytesSent += sent
+
+    def receive(self):
+        """
+        Returns the messages received since the last call
+        """
+        while not self.closed:
+            try:
+                data = self.socket.recv(65536)
+            except BlockingIOError:
+                break
+            except OSError:
+                self.close()
+                break
+            if len(data) == 0:
+                self.close()
+                break
+            self.bytesReceived += len(data)
+            self.inData += data
+        messages = [ ]
+        headerSize = struct.calcsize(lengthFormat)
+        offset = 0
+        while len(self.inData) - offset >= headerSize:
+            length, = struct.unpack_from(lengthFormat,self.inData,offset)
+            if len(self.inData) - offset - headerSize < length:
+                break
+            offset += headerSize
+            messages.append(bytes(self.inData[offset:offset + length]))
+            offset += length
+        del self.inData[:offset]
+        return messages
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.socket.close()
+
+
+class ReplicatedState():
+    """
+    State of a game sent to the clients: quantized units, and bullets.
+
+    A state is sent as a delta from a state the client already has: only the
+    changed units (position, turret, orientation or status) are sent. Bullets
+    are only sent when they are fired, with their direction, and then clients
+    move them until the server tells they are destroyed. The size of a delta
+    depends on what happens during the epochs, not on the number of units and
+    bullets.
+    """
+    def __init__(self,epoch=-1,status=running,unitCount=0):
+        self.epoch = epoch
+        self.status = status
+        self.unitPositions = np.zeros((unitCount,2),dtype=np.int16)
+        self.unitTurrets = np.zeros(unitCount,dtype=np.uint8)
+        self.unitOrientations = np.zeros(unitCount,dtype=np.uint8)
+        self.unitStatuses = np.zeros(unitCount,dtype=np.uint8)
+        self.bulletIds = np.zeros(0,dtype=np.int64)
+        self.bulletPositions = np.zeros((0,2))
+        self.bulletDirections = np.zeros((0,2))
+        self.bulletOwners = np.zeros(0,dtype=np.uint16)
+
+    @property
+    def unitCount(self):
+        return len(self.unitStatuses)
+
+    @staticmethod
+    def fromGameState(state,status):
+        units = state.units
+        replicatedState = ReplicatedState(state.epoch,status,len(units))
+        positions = np.array([ (unit.position.x,unit.position.y) for unit in units ]).reshape((-1,2))
+        targets = np.array([ (unit.weaponTarget.x,unit.weaponTarget.y) for unit in units ]).reshape((-1,2))
+        replicatedState.unitPositions[:] = np.round(positions * positionScale)
+        # Turret angle as in UnitsLayer
+        sizes = targets - positions
+        turrets = np.degrees(np.arctan2(-sizes[:,0],-sizes[:,1]))
+        replicatedState.unitTurrets[:] = np.round(turrets * angleScale).astype(np.int64) % 256
+        orientations = np.array([ unit.orientation for unit in units ])
+        replicatedState.unitOrientations[:] = np.round(orientations * angleScale).astype(np.int64) % 256
+        replicatedState.unitStatuses[:] = [ unit.status for unit in units ]
+
+        bullets = state.bullets
+        count = bullets.count
+        replicatedState.bulletIds = bullets.ids[:count].copy()
+        replicatedState.bulletPositions = bullets.positions[:count].copy()
+        replicatedState.bulletDirections = bullets.directions[:count].copy()
+        replicatedState.bulletOwners = bullets.owners[:count].astype(np.uint16)
+        return replicatedState
+
+    def changedUnits(self,baseline):
+        """
+        Returns the indices of the units that changed since a baseline state
+        (all of them if baseline is None)
+        """
+        if baseline is None:
+            return np.arange(self.unitCount)
+        changed = np.any(self.unitPositions != baseline.unitPositions,axis=1) \
+                | (self.unitTurrets != baseline.unitTurrets) \
+                | (self.unitOrientations != baseline.unitOrientations) \
+                | (self.unitStatuses != baseline.unitStatuses)
+        return np.flatnonzero(changed)
+
+    def encode(self,baseline=None):
+        """
+        Returns the state message of this state, as a delta from baseline (or
+        the full state if baseline is None)
+        """
+        changed = self.changedUnits(baseline)
+        if baseline is None:
+            spawned = np.ones(len(self.bulletIds),dtype=bool)
+            removed = np.zeros(0,dtype=np.int64)
+        else:
+            spawned = ~np.isin(self.bulletIds,baseline.bulletIds,assume_unique=True)
+            removed = baseline.bulletIds[~np.isin(baseline.bulletIds,self.bulletIds,assume_unique=True)]
+        data = [
+            struct.pack(stateFormat,stateMessage,self.epoch,-1 if baseline is None else baseline.epoch,
+                self.status,self.unitCount,len(changed),int(np.count_nonzero(spawned)),len(removed)
+            ),
+            changed.astype('<u2').tobytes(),
+            self.unitPositions[changed].astype('<i2').tobytes(),
+            self.unitTurrets[changed].tobytes(),
+            self.unitOrientations[changed].tobytes(),
+            self.unitStatuses[changed].tobytes(),
+            self.bulletIds[spawned].astype('<u4').tobytes(),
+            np.round(self.bulletPositions[spawned] * positionScale).astype('<i2').tobytes(),
+            np.round(self.bulletDirections[spawned] * directionScale).astype('<i2').tobytes(),
+            self.bulletOwners[spawned].astype('<u2').tobytes(),
+            removed.astype('<u4').tobytes()
+        ]
+        return b''.join(data)
+
+    @staticmethod
+    def decode(message,baseline,bulletSpeed):
+        """
+        Returns the state of a state message, knowing its baseline state (None
+        for a full state). Bullets of the baseline are moved to the new epoch.
+        """
+        headerSize = struct.calcsize(stateFormat)
+        messageType, epoch, baselineEpoch, status, unitCount, changedCount, spawnedCount, removedCount = \
+            struct.unpack_from(stateFormat,message)
+        arrays = [
+            ('<u2',changedCount,1),
+            ('<i2',changedCount,2),
+            ('u1',changedCount,1),
+            ('u1',changedCount,1),
+            ('u1',changedCount,1),
+            ('<u4',spawnedCount,1),
+            ('<i2',spawnedCount,2),
+            ('<i2',spawnedCount,2),
+            ('<u2',spawnedCount,1),
+            ('<u4',removedCount,1)
+        ]
+        if len(message) != headerSize + sum(np.dtype(dtype).itemsize * count * columns for dtype, count, columns in arrays):
+            raise RuntimeError("Error in state message: invalid size")
+        offset = headerSize
+        values = [ ]
+        for dtype, count, columns in arrays:
+            array = np.frombuffer(message,dtype=dtype,count=count * columns,offset=offset)
+            offset += array.nbytes
+            values.append(array.reshape((count,columns)) if columns > 1 else array)
+        changed, positions, turrets, orientations, statuses, spawnedIds, spawnedPositions, spawnedDirections, spawnedOwners, removed = values
+
+        if baseline is None:
+            baseline = ReplicatedState(-1,running,unitCount)
+        elif baseline.unitCount != unitCount:
+            raise RuntimeError("Error in state message: invalid unit count")
+        state = ReplicatedState(epoch,status,0)
+        state.unitPositions = baseline.unitPositions.copy()
+        state.unitPositions[changed] = positions
+        state.unitTurrets = baseline.unitTurrets.copy()
+        state.unitTurrets[changed] = turrets
+        state.unitOrientations = baseline.unitOrientations.copy()
+        state.unitOrientations[changed] = orientations
+        state.unitStatuses = baseline.unitStatuses.copy()
+        state.unitStatuses[changed] = statuses
+
+        # Bullets of the baseline still alive (moved to this epoch), and then the new ones
+        kept = ~np.isin(baseline.bulletIds,removed)
+        keptPositions = baseline.bulletPositions[kept] \
+                      + baseline.bulletDirections[kept] * bulletSpeed * (epoch - baseline.epoch)
+        state.bulletIds = np.concatenate((baseline.bulletIds[kept],spawnedIds.astype(np.int64)))
+        state.bulletPositions = np.concatenate((keptPositions,spawnedPositions / positionScale))
+        state.bulletDirections = np.concatenate((baseline.bulletDirections[kept],spawnedDirections / directionScale))
+        state.bulletOwners = np.concatenate((baseline.bulletOwners[kept],spawnedOwners.astype(np.uint16)))
+        return state
+
+
+class ServerGameMode(PlayGameMode):
+    """
+    Game run by the server, without layers, with a tank for each player.
+
+    Enemies chase the first live player.
+    """
+    def __init__(self,levelFileName,playerCount):
+        super().__init__(headless=True)
+        self.status = running
+        self.commands.append(LoadLevelCommand(self,levelFileName))
+        self.commands.run()
+        self.playerUnits = addPlayerUnits(self.gameState,playerCount)
+        checkReplicationLimits(self.gameState)
+        self.resetSnapshots()
+
+    def createPlayersCommands(self,inputs):
+        """
+        Create the commands of an epoch, with the inputs of each player: a
+        dictionary of (moveVector, targetCell, shoot), indexed by player
+        """
+        if self.gameOver:
+            return
+        for playerIndex, (moveVector, targetCell, shoot) in inputs.items():
+            unit = self.playerUnits[playerIndex]
+            if unit.status == Status.ALIVE:
+                self.createUnitCommands(unit,moveVector,targetCell,shoot)
+        for unit in self.playerUnits:
+            if unit.status == Status.ALIVE:
+                self.playerUnit = unit
+                break
+        self.createEnemyCommands(self.playerUnits)
+        self.commands.moveBullets(len(self.gameState.bullets))
+
+    def checkGameOver(self):
+        if all(unit.status != Status.ALIVE for unit in self.playerUnits):
+            self.gameOver = True
+            self.status = lost
+        elif all(unit.status != Status.ALIVE for unit in self.gameState.units if unit not in self.playerUnits):
+            self.gameOver = True
+            self.status = won
+
+
+class ServerClient():
+    """
+    A client connected to the server: its player, its last acknowledged epoch,
+    and the inputs received since the last epoch
+    """
+    def __init__(self,connection,playerIndex):
+        self.connection = connection
+        self.playerIndex = playerIndex
+        self.ackEpoch = -1
+        self.moveVector = Vector2()
+        self.targetCell = None
+        self.shoot = False
+
+    def addInput(self,message):
+        messageType, ackEpoch, moveX, moveY, flags, targetX, targetY = struct.unpack(inputFormat,message)
+        self.ackEpoch = max(self.ackEpoch,ackEpoch)
+        if moveX != 0 or moveY != 0:
+            self.moveVector = Vector2(moveX,moveY)
+        if flags & targetFlag:
+            self.targetCell = Vector2(targetX,targetY)
+        if flags & shootFlag:
+            self.shoot = True
+
+    def takeInput(self):
+        inputs = (self.moveVector,self.targetCell,self.shoot)
+        self.moveVector = Vector2()
+        self.targetCell = None
+        self.shoot = False
+        return inputs
+
+
+class GameServer():
+    """
+    Authoritative game server: it runs the game with the inputs of the
+    clients, and sends them the state of each epoch.
+
+    The states of the last historySize epochs are kept. Each client gets the
+    delta from the last state it acknowledged (or the full state if it is too
+    old), and clients that acknowledged the same epoch share the same message.
+    Clients with more than maxPendingSize bytes waiting are skipped: they get
+    a larger delta when they catch up. The game starts when the first client
+    joins.
+    """
+    def __init__(self,levelFileName,port=0,playerCount=2,host='127.0.0.1',historySize=64,maxPendingSize=65536):
+        self.levelFileName = levelFileName
+        self.playerCount = playerCount
+        self.historySize = historySize
+        self.maxPendingSize = maxPendingSize
+        self.gameMode = ServerGameMode(levelFileName,playerCount)
+        self.listener = socket.create_server((host,port))
+        self.listener.setblocking(False)
+        self.port = self.listener.getsockname()[1]
+        self.clients = [ ]
+        self.history = OrderedDict()
+        self.started = False
+        self.epochCount = 0
+        self.tickTime = 0
+
+    @property
+    def gameState(self):
+        return self.gameMode.gameState
+
+    def accept(self):
+        while True:
+            try:
+                sock, address = self.listener.accept()
+            except BlockingIOError:
+                return
+            connection = Connection(sock)
+            usedIndices = [ client.playerIndex for client in self.clients ]
+            freeIndices = [ index for index in range(self.playerCount) if index not in usedIndices ]
+            if len(freeIndices) == 0:
+                connection.close()
+                continue
+            client = ServerClient(connection,freeIndices[0])
+            self.clients.append(client)
+            self.started = True
+            state = self.gameState
+            unitIndex = state.units.index(self.gameMode.playerUnits[client.playerIndex])
+            levelData = self.levelFileName.encode('utf-8')
+            connection.send(struct.pack(welcomeFormat,welcomeMessage,client.playerIndex,self.playerCount,
+                unitIndex,len(state.units),len(levelData)) + levelData
+            )
+
+    def receive(self):
+        for client in self.clients:
+            for message in client.connection.receive():
+                if len(message) == struct.calcsize(inputFormat) and message[0] == inputMessage:
+                    client.addInput(message)
+        self.clients = [ client for client in self.clients if not client.connection.closed ]
+
+    def step(self):
+        """
+        Accept and read clients, and run one epoch if the game started
+        """
+        self.accept()
+        self.receive()
+        if not self.started:
+            return
+        startTime = time.perf_counter()
+        inputs = { client.playerIndex: client.takeInput() for client in self.clients }
+        gameMode = self.gameMode
+        gameMode.createPlayersCommands(inputs)
+        gameMode.update()
+        state = ReplicatedState.fromGameState(self.gameState,gameMode.status)
+        self.history[state.epoch] = state
+        if len(self.history) > self.historySize:
+            self.history.popitem(last=False)
+
+        # One message per acknowledged epoch
+        messages = { }
+        for client in self.clients:
+            client.connection.flush()
+            if client.connection.pendingSize > self.maxPendingSize:
+                continue
+            baseline = self.history.get(client.ackEpoch)
+            baselineEpoch = -1 if baseline is None else baseline.epoch
+            if baselineEpoch not in messages:
+                messages[baselineEpoch] = state.encode(baseline)
+            client.connection.send(messages[baselineEpoch])
+        self.epochCount += 1
+        self.tickTime += time.perf_counter() - startTime
+
+    def run(self,ticksPerSecond=60,maxEpochs=None):
+        """
+        Run epochs until the game is over and all the clients left (or after
+        maxEpochs epochs)
+        """
+        nextTickTime = time.perf_counter()
+        while maxEpochs is None or self.epochCount < maxEpochs:
+            self.step()
+            if self.started and self.gameMode.gameOver and len(self.clients) == 0:
+                break
+            nextTickTime += 1 / ticksPerSecond
+            delay = nextTickTime - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+    def close(self):
+        for client in self.clients:
+            client.connection.close()
+        self.clients = [ ]
+        self.listener.close()
+
+
+class GameClient():
+    """
+    Connection to a game server: it sends the player's inputs and the
+    received epochs, and receives the states of the game (see ReplicatedState).
+
+    As the server, the client keeps the states of the last historySize epochs.
+    """
+    def __init__(self,host,port,timeout=5,historySize=64):
+        self.connection = Connection(socket.create_connection((host,port),timeout))
+        self.playerIndex = None
+        self.playerCount = 0
+        self.unitIndex = 0
+        self.unitCount = 0
+        self.levelFileName = None
+        self.historySize = historySize
+        # Received states (baselines of the next deltas), and the last one
+        self.states = { }
+        self.state = None
+        self.lastTarget = None
+
+    @property
+    def joined(self):
+        return self.playerIndex is not None
+
+    @property
+    def closed(self):
+        return self.connection.closed
+
+    def join(self,timeout=5):
+        """
+        Wait for the welcome message of the server
+        """
+        endTime = time.perf_counter() + timeout
+        while not self.joined:
+            self.poll(0)
+            if self.closed:
+                raise RuntimeError("Error in client: connection closed by the server")
+            if time.perf_counter() > endTime:
+                raise RuntimeError("Error in client: no answer from the server")
+            time.sleep(0.001)
+
+    def poll(self,bulletSpeed):
+        """
+        Read the messages of the server, and returns the last state (or None)
+        """
+        for message in self.connection.receive():
+            if message[0] == welcomeMessage:
+                headerSize = struct.calcsize(welcomeFormat)
+                messageType, self.playerIndex, self.playerCount, self.unitIndex, self.unitCount, nameLength = \
+                    struct.unpack_from(welcomeFormat,message)
+                self.levelFileName = message[headerSize:headerSize + nameLength].decode('utf-8')
+            elif message[0] == stateMessage:
+                epoch, baselineEpoch = struct.unpack_from('<qq',message,1)
+                baseline = None
+                if baselineEpoch >= 0:
+                    baseline = self.states.get(baselineEpoch)
+                    if baseline is None:
+                        raise RuntimeError("Error in client: unknown baseline epoch {}".format(baselineEpoch))
+                state = ReplicatedState.decode(message,baseline,bulletSpeed)
+                # The next baselines are at least as recent as this one (or this
+                # one for a full state)
+                if baseline is None:
+                    self.states = { }
+                else:
+                    self.states = { stateEpoch: value for stateEpoch, value in self.states.items() if stateEpoch >= baselineEpoch }
+                self.states[epoch] = state
+                while len(self.states) > self.historySize:
+                    del self.states[min(self.states)]
+                self.state = state
+        return self.state
+
+    def sendInput(self,moveVector,targetCell,shoot):
+        """
+        Send the inputs of the player (the target only if it changed), and the last received epoch
+        """
+        flags = 0
+        if shoot:
+            flags |= shootFlag
+        targetX, targetY = 0, 0
+        if targetCell is not None and targetCell != self.lastTarget:
+            flags |= targetFlag
+            targetX, targetY = targetCell.x, targetCell.y
+            self.lastTarget = Vector2(targetCell)
+        ackEpoch = -1 if self.state is None else self.state.epoch
+        self.connection.send(struct.pack(inputFormat,inputMessage,ackEpoch,
+            int(moveVector.x),int(moveVector.y),flags,targetX,targetY
+        ))
+
+    @property
+    def bytesReceived(self):
+        return self.connection.bytesReceived
+
+    def close(self):
+        self.connection.close()
+
+
+class ClientPlayGameMode(PlayGameMode):
+    """
+    Play mode of a game run by a server (see GameServer).
+
+    The player's inputs are sent to the server, and the game state is set to
+    the states received from it; the layers render it as usual. Snapshots are
+    disabled: only the server can change the game.
+    """
+    def __init__(self,client):
+        super().__init__()
+        self.client = client
+        self.appliedState = None
+
+    def release(self):
+        super().release()
+        self.client.close()
+
+    def createCommands(self,moveVector,targetCell,shoot):
+        # Inputs are also sent after the game over: they acknowledge the received states
+        self.client.sendInput(moveVector,targetCell,shoot)
+
+    def restoreSnapshot(self,snapshot):
+        pass
+
+    def rewind(self,epochCount):
+        pass
+
+    def update(self):
+        # Level loading
+        self.commands.run()
+        state = self.gameState
+        if len(state.units) < self.client.unitCount:
+            addPlayerUnits(state,self.client.playerCount)
+        self.playerUnit = state.units[self.client.unitIndex]
+
+        replicatedState = self.client.poll(state.bulletSpeed)
+        if replicatedState is not None and replicatedState is not self.appliedState:
+            self.applyState(replicatedState)
+        if self.client.closed and not self.gameOver:
+            print("Connection closed by the server")
+            self.gameOver = True
+            self.notifyShowMenuRequested()
+
+        # Events of this epoch
+        state.events.dispatch()
+        self.events.dispatch()
+        self.flushSounds()
+
+    def applyState(self,replicatedState):
+        state = self.gameState
+        units = state.units
+        if replicatedState.unitCount != len(units):
+            raise RuntimeError("Error in client: the state of the server does not match the level")
+        state.epoch = replicatedState.epoch
+
+        # Units
+        positions = replicatedState.unitPositions / positionScale
+        turrets = np.radians(replicatedState.unitTurrets / angleScale)
+        orientations = replicatedState.unitOrientations / angleScale
+        for index in replicatedState.changedUnits(self.appliedState):
+            unit = units[index]
+            position = Vector2(float(positions[index,0]),float(positions[index,1]))
+            if position != unit.position:
+                unit.previousPosition = unit.position
+                unit.lastMoveEpoch = state.epoch - 1
+                state.moveUnit(unit,position)
+            angle = float(turrets[index])
+            unit.weaponTarget = position + Vector2(-math.sin(angle),-math.cos(angle))
+            unit.orientation = float(orientations[index])
+            status = Status(int(replicatedState.unitStatuses[index]))
+            if status != unit.status:
+                unit.status = status
+                if status == Status.DESTROYED:
+                    state.notifyUnitDestroyed(unit)
+
+        # Bullets (bullets already there are interpolated from their previous position)
+        bullets = state.bullets
+        ids = replicatedState.bulletIds
+        count = len(ids)
+        known = np.zeros(count,dtype=bool)
+        previousPositions = replicatedState.bulletPositions.copy()
+        if bullets.count > 0:
+            indices = np.minimum(np.searchsorted(bullets.ids[:bullets.count],ids),bullets.count - 1)
+            known = bullets.ids[indices] == ids
+            previousPositions[known] = bullets.positions[indices[known]]
+        while bullets.capacity < count:
+            bullets.grow()
+        bullets.count = count
+        bullets.positions[:count] = replicatedState.bulletPositions
+        bullets.previousPositions[:count] = previousPositions
+        bullets.directions[:count] = replicatedState.bulletDirections
+        bullets.owners[:count] = replicatedState.bulletOwners
+        bullets.ids[:count] = ids
+        for owner in replicatedState.bulletOwners[~known]:
+            state.notifyBulletFired(units[owner])
+
+        # Game over
+        if not self.gameOver and replicatedState.status != running:
+            self.gameOver = True
+            if replicatedState.status == won:
+                self.notifyGameWon()
+            else:
+                self.notifyGameLost()
+        self.appliedState = replicatedState
+
+
+def testServer(levelFileName,clientCount,epochCount,seed=0):
+    """
+    Run a server and clients with random inputs on localhost, in lockstep.
+
+    Returns the server, the clients, and the largest difference between the
+    units and bullets of the server and the ones of the clients
+    """
+    server = GameServer(levelFileName,0,clientCount)
+    clients = [ ]
+    try:
+        for index in range(clientCount):
+            client = GameClient('127.0.0.1',server.port,historySize=server.historySize)
+            server.step()
+            client.join()
+            clients.append(client)
+        randoms = [ random.Random(seed + index) for index in range(clientCount) ]
+        state = server.gameState
+        moves = [ Vector2(1,0), Vector2(-1,0), Vector2(0,1), Vector2(0,-1) ]
+        for epoch in range(epochCount):
+            for client, generator in zip(clients,randoms):
+                client.poll(state.bulletSpeed)
+                moveVector = generator.choice(moves) if generator.random() < 0.05 else Vector2()
+                targetCell = Vector2(generator.uniform(0,state.worldWidth - 1),generator.uniform(0,state.worldHeight - 1))
+                client.sendInput(moveVector,targetCell,generator.random() < 0.3)
+            server.step()
+            if server.gameMode.gameOver:
+                break
+        # Last state
+        time.sleep(0.05)
+        for client in clients:
+            client.poll(state.bulletSpeed)
+        serverState = server.history[next(reversed(server.history))]
+        unitError = 0
+        bulletError = 0
+        for client in clients:
+            clientState = client.state
+            if clientState.epoch != serverState.epoch or not np.array_equal(clientState.bulletIds,serverState.bulletIds):
+                raise RuntimeError("Error in client: the last state was not received")
+            unitError = max(unitError,int(np.abs(clientState.unitPositions.astype(np.int64) - serverState.unitPositions).max(initial=0)))
+            bulletError = max(bulletError,float(np.abs(clientState.bulletPositions - serverState.bulletPositions).max(initial=0)))
+    finally:
+        for client in clients:
+            client.close()
+        server.close()
+    return server, clients, max(unitError / positionScale,bulletError)
+
+
+if __name__ == '__main__':
+    useDummyDrivers()
+
+    parser = argparse.ArgumentParser(description="Game server (use TankGame.py --connect HOST:PORT to join it)")
+    parser.add_argument('level', help="TMX level file")
+    parser.add_argument('--port', type=int, default=5555, help="TCP port")
+    parser.add_argument('--host', default='127.0.0.1', help="listening address")
+    parser.add_argument('--players', type=int, default=2, help="number of players")
+    parser.add_argument('--tps', type=float, default=60, help="ticks per second")
+    parser.add_argument('--test', type=int, metavar='EPOCHS', help="run --players clients with random inputs on localhost for EPOCHS epochs, as fast as possible")
+    args = parser.parse_args()
+    try:
+        if args.test is not None:
+            server, clients, error = testServer(args.level, args.players, args.test)
+            epochCount = max(1, server.epochCount)
+            print("Epochs: {}".format(server.epochCount))
+            print("Server tick: {:.3f} ms".format(1000 * server.tickTime / epochCount))
+            for client in clients:
+                print("Client {}: {:.1f} bytes/epoch".format(client.playerIndex, client.bytesReceived / epochCount))
+            print("Largest position error: {:.4f} cell".format(error))
+        else:
+            server = GameServer(args.level, args.port, args.players, args.host)
+            print("Listening on {}:{}".format(args.host, server.port))
+            try:
+                server.run(args.tps)
+            finally:
+                server.close()
+    except Exception as ex:
+        print(ex)
+        sys.exit(1)
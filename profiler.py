@@ -0,0 +1,188 @@
+import csv
+import json
+import time
+import numpy as np
+import pygame
+from assets import assets
+
+
+class Profiler():
+    """
+    Timings and counts of the last frames, stored in a ring buffer.
+
+    Each frame is a row, and each (group, name) pair a column, created on
+    first use: for instance ('phase','update'), ('layer','UnitsLayer'),
+    ('command','MoveCommand') or ('count','bullets'). Times are in milliseconds.
+
+    When the profiler is disabled, all methods return at once, so calls can
+    stay in the game loop.
+    """
+    def __init__(self,capacity=600):
+        self.enabled = False
+        self.capacity = capacity
+        self.columns = { }
+        self.names = [ ]
+        self.frames = np.zeros((capacity,16))
+        self.frame = np.zeros(16)
+        self.frameCount = 0
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def toggle(self):
+        self.enabled = not self.enabled
+
+    def clear(self):
+        self.frames[:] = 0
+        self.frame[:] = 0
+        self.frameCount = 0
+
+    def column(self,group,name):
+        key = (group,name)
+        column = self.columns.get(key)
+        if column is None:
+            column = len(self.names)
+            if column >= self.frame.shape[0]:
+                size = 2 * self.frame.shape[0]
+                frames = np.zeros((self.capacity,size))
+                frames[:,:column] = self.frames
+                self.frames = frames
+                frame = np.zeros(size)
+                frame[:column] = self.frame
+                self.frame = frame
+            self.columns[key] = column
+            self.names.append("{}.{}".format(group,name))
+        return column
+
+    def start(self):
+        """
+        Returns the start time of a measure (see stop()), or None when disabled
+        """
+        if not self.enabled:
+            return None
+        return time.perf_counter()
+
+    def stop(self,group,name,startTime):
+        """
+        Add the time since startTime to the current frame
+
+        A measure started while the profiler was disabled is ignored.
+        """
+        if not self.enabled or startTime is None:
+            return
+        elapsedTime = time.perf_counter() - startTime
+        column = self.column(group,name)
+        self.frame[column] += elapsedTime * 1000
+
+    def addCount(self,group,name,count):
+        if not self.enabled:
+            return
+        column = self.column(group,name)
+        self.frame[column] += count
+
+    def setCount(self,group,name,count):
+        if not self.enabled:
+            return
+        column = self.column(group,name)
+        self.frame[column] = count
+
+    def endFrame(self):
+        """
+        Store the current frame in the ring buffer, and start a new one
+        """
+        if not self.enabled:
+            return
+        self.frames[self.frameCount % self.capacity] = self.frame
+        self.frame[:] = 0
+        self.frameCount += 1
+
+    @property
+    def rowCount(self):
+        return min(self.frameCount,self.capacity)
+
+    def rows(self):
+        """
+        Returns the stored frames, from the oldest to the newest
+        """
+        if self.frameCount <= self.capacity:
+            return self.frames[:self.frameCount,:len(self.names)]
+        index = self.frameCount % self.capacity
+        return np.concatenate((self.frames[index:],self.frames[:index]))[:,:len(self.names)]
+
+    def averages(self):
+        """
+        Returns a dict with the average of each column over the stored frames
+        """
+        rows = self.rows()
+        if len(rows) == 0:
+            return { }
+        return dict(zip(self.names,rows.mean(axis=0)))
+
+    def dumpCsv(self,fileName):
+        firstFrame = self.frameCount - self.rowCount
+        with open(fileName,'w',newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(['frame'] + self.names)
+            for index, row in enumerate(self.rows()):
+                writer.writerow([firstFrame + index] + row.tolist())
+
+    def dumpJson(self,fileName):
+        with open(fileName,'w') as file:
+            json.dump({
+                'firstFrame': self.frameCount - self.rowCount,
+                'columns': self.names,
+                'frames': self.rows().tolist()
+            },file)
+
+    def dump(self,fileName):
+        """
+        Save the stored frames, in JSON if the file name ends with .json, in CSV otherwise
+        """
+        if fileName.lower().endswith('.json'):
+            self.dumpJson(fileName)
+        else:
+            self.dumpCsv(fileName)
+
+
+class ProfilerOverlay():
+    """
+    Averages of the profiler columns, drawn at the top left of the window
+    """
+    def __init__(self,profiler,fontSize=18):
+        self.profiler = profiler
+        self.fontSize = fontSize
+        self.font = assets.loadFont(None,fontSize)
+
+    def release(self):
+        assets.releaseFont(None,self.fontSize)
+
+    def render(self,window):
+        # Name and value of each line (the font is not monospaced, and names are cached)
+        lines = [ ("frames","{}".format(self.profiler.rowCount)) ]
+        for name, value in self.profiler.averages().items():
+            if name.startswith('count.'):
+                lines.append((name,"{:.1f}".format(value)))
+            else:
+                lines.append((name,"{:.2f} ms".format(value)))
+        color = (255,255,255)
+        surfaces = [ (assets.renderText(self.font,name,color),self.font.render(value,True,color)) for name, value in lines ]
+        nameWidth = max(name.get_width() for name, value in surfaces)
+        valueWidth = max(value.get_width() for name, value in surfaces)
+        lineHeight = self.font.get_linesize()
+
+        # Translucent background, and then the lines
+        background = pygame.Surface((nameWidth + valueWidth + 30,len(lines) * lineHeight + 10),flags=pygame.SRCALPHA)
+        background.fill((0,0,0,180))
+        window.blit(background,(0,0))
+        y = 5
+        for name, value in surfaces:
+            window.blit(name,(5,y))
+            window.blit(value,(nameWidth + valueWidth + 25 - value.get_width(),y))
+            y += lineHeight
+
+
+# Profiler shared by the game loop, the game modes and the commands
+profiler = Profiler()
@@ -0,0 +1,241 @@
+import sys
+import struct
+import argparse
+import pygame
+from pygame.math import Vector2
+from gamemode import PlayGameMode
+from headless import PlayerPolicy, HeadlessRunner, useDummyDrivers
+from profiler import profiler
+
+# File layout: magic, version and level file name, and then one record per epoch
+# with the player's inputs. A record starts with a flags byte:
+# - moveFlag: followed by the move vector (2 x int8)
+# - target32Flag or target64Flag: followed by the new target (2 x float32 or float64)
+# - shootFlag: no data
+# - idleFlag alone: followed by the number of epochs without input (varint)
+magic = b'TKRC'
+version = 1
+headerFormat = '<4sBH'
+moveFlag = 1
+target32Flag = 2
+target64Flag = 4
+shootFlag = 8
+idleFlag = 128
+
+
+class Recorder():
+    """
+    Write the player's inputs of each epoch in a compact binary log.
+
+    Records are streamed to the file; idle epochs are run-length encoded, and
+    targets are only written when they change.
+    """
+    def __init__(self,fileName,levelFileName):
+        self.fileName = fileName
+        self.file = open(fileName,'wb')
+        levelData = levelFileName.encode('utf-8')
+        self.file.write(struct.pack(headerFormat,magic,version,len(levelData)))
+        self.file.write(levelData)
+        self.lastTarget = None
+        self.idleCount = 0
+        self.epochCount = 0
+
+    def writeVarint(self,value):
+        data = bytearray()
+        while value >= 0x80:
+            data.append((value & 0x7F) | 0x80)
+            value >>= 7
+        data.append(value)
+        self.file.write(data)
+
+    def flushIdle(self):
+        if self.idleCount > 0:
+            self.file.write(bytes([idleFlag]))
+            self.writeVarint(self.idleCount)
+            self.idleCount = 0
+
+    def record(self,moveVector,targetCell,shoot):
+        """
+        Record the inputs of one epoch (see PlayGameMode.createCommands)
+        """
+        self.epochCount += 1
+        flags = 0
+        data = b''
+        if moveVector.x != 0 or moveVector.y != 0:
+            flags |= moveFlag
+            data += struct.pack('<bb',int(moveVector.x),int(moveVector.y))
+        if targetCell is not None and targetCell != self.lastTarget:
+            # Use float32 if there is no loss of precision (targets from the mouse)
+            data32 = struct.pack('<ff',targetCell.x,targetCell.y)
+            if Vector2(struct.unpack('<ff',data32)) == targetCell:
+                flags |= target32Flag
+                data += data32
+            else:
+                flags |= target64Flag
+                data += struct.pack('<dd',targetCell.x,targetCell.y)
+            self.lastTarget = Vector2(targetCell)
+        if shoot:
+            flags |= shootFlag
+        if flags == 0:
+            self.idleCount += 1
+            return
+        self.flushIdle()
+        self.file.write(bytes([flags]))
+        self.file.write(data)
+
+    def close(self):
+        if self.file is not None:
+            self.flushIdle()
+            self.file.close()
+            self.file = None
+
+
+class ReplayReader():
+    """
+    Read a log written by a Recorder, one epoch at a time
+    """
+    def __init__(self,fileName):
+        self.fileName = fileName
+        self.file = open(fileName,'rb')
+        header = self.file.read(struct.calcsize(headerFormat))
+        if len(header) != struct.calcsize(headerFormat):
+            raise RuntimeError("Error in {}: invalid replay file".format(fileName))
+        fileMagic, fileVersion, levelLength = struct.unpack(headerFormat,header)
+        if fileMagic != magic or fileVersion != version:
+            raise RuntimeError("Error in {}: invalid replay file".format(fileName))
+        self.levelFileName = self.file.read(levelLength).decode('utf-8')
+        self.target = None
+        self.idleCount = 0
+
+    def readExactly(self,size):
+        data = self.file.read(size)
+        if len(data) != size:
+            raise RuntimeError("Error in {}: truncated replay file".format(self.fileName))
+        return data
+
+    def readVarint(self):
+        value = 0
+        shift = 0
+        while True:
+            byte = self.readExactly(1)[0]
+            value |= (byte & 0x7F) << shift
+            if byte < 0x80:
+                return value
+            shift += 7
+
+    def next(self):
+        """
+        Returns the (moveVector, targetCell, shoot) inputs of the next epoch, or None at the end
+        """
+        if self.idleCount > 0:
+            self.idleCount -= 1
+            return Vector2(), self.target, False
+        data = self.file.read(1)
+        if len(data) == 0:
+            return None
+        flags = data[0]
+        if flags == idleFlag:
+            self.idleCount = self.readVarint() - 1
+            return Vector2(), self.target, False
+        moveVector = Vector2()
+        if flags & moveFlag:
+            moveVector = Vector2(struct.unpack('<bb',self.readExactly(2)))
+        if flags & target32Flag:
+            self.target = Vector2(struct.unpack('<ff',self.readExactly(8)))
+        elif flags & target64Flag:
+            self.target = Vector2(struct.unpack('<dd',self.readExactly(16)))
+        target = None if self.target is None else Vector2(self.target)
+        return moveVector, target, (flags & shootFlag) != 0
+
+    def close(self):
+        self.file.close()
+
+
+class ReplayPolicy(PlayerPolicy):
+    """
+    Player's inputs from a replay file
+    """
+    def __init__(self,reader):
+        self.reader = reader
+        self.nextInputs = reader.next()
+
+    @property
+    def finished(self):
+        return self.nextInputs is None
+
+    def nextInput(self,gameMode):
+        inputs = self.nextInputs
+        if inputs is None:
+            return Vector2(), None, False
+        self.nextInputs = self.reader.next()
+        return inputs
+
+
+class ReplayPlayGameMode(PlayGameMode):
+    """
+    Play mode driven by a replay file, rendered in real time.
+
+    The keyboard and the mouse are ignored, except to quit, go back to the menu,
+    or show the profiler (F3).
+    """
+    def __init__(self,fileName):
+        super().__init__()
+        self.reader = ReplayReader(fileName)
+        self.policy = ReplayPolicy(self.reader)
+
+    @property
+    def levelFileName(self):
+        return self.reader.levelFileName
+
+    def processInput(self):
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                self.notifyQuitRequested()
+                break
+            elif event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE:
+                self.notifyShowMenuRequested()
+                break
+            elif event.type == pygame.KEYDOWN and event.key == pygame.K_F3:
+                profiler.toggle()
+        if self.policy.finished:
+            if not self.gameOver:
+                self.gameOver = True
+                self.notifyShowMenuRequested()
+            return
+        self.createCommands(*self.policy.nextInput(self))
+
+    def release(self):
+        super().release()
+        self.reader.close()
+
+
+def replayHeadless(fileName):
+    """
+    Replay a file without rendering, as fast as possible
+
+    Returns the headless runner, with the winner and the replay speed
+    """
+    reader = ReplayReader(fileName)
+    try:
+        runner = HeadlessRunner(reader.levelFileName,ReplayPolicy(reader))
+        runner.run(sys.maxsize)
+    finally:
+        reader.close()
+    return runner
+
+
+if __name__ == '__main__':
+    useDummyDrivers()
+
+    parser = argparse.ArgumentParser(description="Replay a recorded game as fast as possible (use TankGame.py --replay to watch it)")
+    parser.add_argument('replay', help="replay file")
+    args = parser.parse_args()
+    try:
+        runner = replayHeadless(args.replay)
+    except Exception as ex:
+        print(ex)
+        sys.exit(1)
+    print("Level: {}".format(runner.fileName))
+    print("Winner: {}".format(runner.winner if runner.winner is not None else 'none'))
+    print("Epochs: {}".format(runner.epochCount))
+    print("Time: {:.3f} s ({:.0f} epochs/s)".format(runner.elapsedTime, runner.epochsPerSecond))
@@ -0,0 +1,225 @@
+import struct
+from collections import deque
+import numpy as np
+from pygame.math import Vector2
+from unit import Status
+
+# Serialized layout: header, and then the arrays in the order of Snapshot.arrays
+# (little endian), followed by the walls grid packed in bits
+magic = b'TKSN'
+version = 2
+headerFormat = '<4sBqIIIqHH'
+
+
+class Snapshot():
+    """
+    State of a game at an epoch: units, bullets, walls and epoch.
+
+    Units and bullets are copied in compact arrays. The walls and the ground
+    never change during a game: the snapshot shares them with the game state.
+    A snapshot can only be restored in the game state of the same level, with
+    the same units (only their attributes are restored, so references to them
+    stay valid).
+    """
+    # Arrays: name, type, number of rows (units, occupied cells or bullets) and columns
+    arrays = [
+        ('unitPositions',np.float64,'units',2),
+        ('unitPreviousPositions',np.float64,'units',2),
+        ('unitTargets',np.float64,'units',2),
+        ('unitOrientations',np.float64,'units',1),
+        ('unitStatuses',np.int8,'units',1),
+        ('unitBulletEpochs',np.int64,'units',1),
+        ('unitMoveEpochs',np.int64,'units',1),
+        ('unitCells',np.int32,'cells',1),
+        ('unitCellIndices',np.int32,'cells',1),
+        ('bulletPositions',np.float64,'bullets',2),
+        ('bulletPreviousPositions',np.float64,'bullets',2),
+        ('bulletDirections',np.float64,'bullets',2),
+        ('bulletStartPositions',np.float64,'bullets',2),
+        ('bulletEndPositions',np.float64,'bullets',2),
+        ('bulletOwners',np.int32,'bullets',1),
+        ('bulletIds',np.int64,'bullets',1)
+    ]
+
+    def __init__(self,state=None):
+        self.epoch = 0
+        self.bulletFiredCount = 0
+        self.worldSize = (0,0)
+        self.wallsGrid = None
+        if state is not None:
+            self.take(state)
+
+    def take(self,state):
+        self.epoch = state.epoch
+        self.worldSize = (state.worldWidth,state.worldHeight)
+        self.wallsGrid = state.wallsGrid
+
+        # Units
+        units = state.units
+        self.unitPositions = np.array([ (unit.position.x,unit.position.y) for unit in units ],dtype=np.float64).reshape((-1,2))
+        self.unitPreviousPositions = np.array([ (unit.previousPosition.x,unit.previousPosition.y) for unit in units ],dtype=np.float64).reshape((-1,2))
+        self.unitTargets = np.array([ (unit.weaponTarget.x,unit.weaponTarget.y) for unit in units ],dtype=np.float64).reshape((-1,2))
+        self.unitOrientations = np.array([ unit.orientation for unit in units ],dtype=np.float64)
+        self.unitStatuses = np.array([ unit.status for unit in units ],dtype=np.int8)
+        self.unitBulletEpochs = np.array([ unit.lastBulletEpoch for unit in units ],dtype=np.int64)
+        self.unitMoveEpochs = np.array([ unit.lastMoveEpoch for unit in units ],dtype=np.int64)
+        # Occupied cells of the units grid (flat indices in the bordered grid)
+        grid = state.unitsBorderGrid.ravel()
+        self.unitCells = np.flatnonzero(grid >= 0).astype(np.int32)
+        self.unitCellIndices = grid[self.unitCells]
+
+        # Bullets
+        bullets = state.bullets
+        count = bullets.count
+        self.bulletFiredCount = bullets.firedCount
+        self.bulletPositions = bullets.positions[:count].copy()
+        self.bulletPreviousPositions = bullets.previousPositions[:count].copy()
+        self.bulletDirections = bullets.directions[:count].copy()
+        self.bulletStartPositions = bullets.startPositions[:count].copy()
+        self.bulletEndPositions = bullets.endPositions[:count].copy()
+        self.bulletOwners = bullets.owners[:count].copy()
+        self.bulletIds = bullets.ids[:count].copy()
+
+    @property
+    def unitCount(self):
+        return len(self.unitStatuses)
+
+    @property
+    def bulletCount(self):
+        return len(self.bulletOwners)
+
+    @property
+    def size(self):
+        """
+        Returns the memory used by the arrays of this snapshot, in bytes (walls excluded)
+        """
+        return sum(getattr(self,name).nbytes for name, dtype, rows, columns in self.arrays)
+
+    def restore(self,state):
+        """
+        Set the game state back to this snapshot
+        """
+        if self.worldSize != (state.worldWidth,state.worldHeight) or self.unitCount != len(state.units):
+            raise RuntimeError("Error in snapshot: it was not taken in the current level")
+        if self.wallsGrid is not state.wallsGrid and not np.array_equal(self.wallsGrid,state.wallsGrid):
+            raise RuntimeError("Error in snapshot: it was not taken in the current level")
+        state.epoch = self.epoch
+
+        # Units
+        for index, unit in enumerate(state.units):
+            unit.position = Vector2(*self.unitPositions[index])
+            unit.cellX = int(unit.position.x)
+            unit.cellY = int(unit.position.y)
+            unit.previousPosition = Vector2(*self.unitPreviousPositions[index])
+            unit.weaponTarget = Vector2(*self.unitTargets[index])
+            unit.orientation = float(self.unitOrientations[index])
+            unit.status = Status(int(self.unitStatuses[index]))
+            unit.lastBulletEpoch = int(self.unitBulletEpochs[index])
+            unit.lastMoveEpoch = int(self.unitMoveEpochs[index])
+        grid = state.unitsBorderGrid.ravel()
+        grid.fill(-1)
+        grid[self.unitCells] = self.unitCellIndices
+
+        # Bullets
+        bullets = state.bullets
+        count = self.bulletCount
+        while bullets.capacity < count:
+            bullets.grow()
+        bullets.count = count
+        bullets.firedCount = self.bulletFiredCount
+        bullets.positions[:count] = self.bulletPositions
+        bullets.previousPositions[:count] = self.bulletPreviousPositions
+        bullets.directions[:count] = self.bulletDirections
+        bullets.startPositions[:count] = self.bulletStartPositions
+        bullets.endPositions[:count] = self.bulletEndPositions
+        bullets.owners[:count] = self.bulletOwners
+        bullets.ids[:count] = self.bulletIds
+
+        # Events of the discarded epochs
+        state.events.clear()
+
+    def toBytes(self):
+        header = struct.pack(headerFormat,magic,version,self.epoch,
+            self.unitCount,len(self.unitCells),self.bulletCount,self.bulletFiredCount,
+            self.worldSize[0],self.worldSize[1]
+        )
+        data = [ header ]
+        for name, dtype, rows, columns in self.arrays:
+            data.append(getattr(self,name).astype(np.dtype(dtype).newbyteorder('<'),copy=False).tobytes())
+        data.append(np.packbits(self.wallsGrid).tobytes())
+        return b''.join(data)
+
+    @staticmethod
+    def fromBytes(data):
+        headerSize = struct.calcsize(headerFormat)
+        if len(data) < headerSize:
+            raise RuntimeError("Error in snapshot: invalid data")
+        fileMagic, fileVersion, epoch, unitCount, cellCount, bulletCount, firedCount, width, height = \
+            struct.unpack_from(headerFormat,data)
+        if fileMagic != magic or fileVersion != version:
+            raise RuntimeError("Error in snapshot: invalid data")
+        offset = headerSize
+
+        snapshot = Snapshot()
+        snapshot.epoch = epoch
+        snapshot.bulletFiredCount = firedCount
+        snapshot.worldSize = (width,height)
+        counts = {
+            'units': unitCount,
+            'cells': cellCount,
+            'bullets': bulletCount
+        }
+        for name, dtype, rows, columns in Snapshot.arrays:
+            shape = (counts[rows],) if columns == 1 else (counts[rows],columns)
+            dtype = np.dtype(dtype).newbyteorder('<')
+            count = counts[rows] * columns
+            size = count * dtype.itemsize
+            if offset + size > len(data):
+                raise RuntimeError("Error in snapshot: truncated data")
+            array = np.frombuffer(data,dtype=dtype,count=count,offset=offset)
+            setattr(snapshot,name,array.reshape(shape).astype(dtype.newbyteorder('=')))
+            offset += size
+        wallsSize = (width * height + 7) // 8
+        if offset + wallsSize != len(data):
+            raise RuntimeError("Error in snapshot: invalid data")
+        walls = np.unpackbits(np.frombuffer(data,dtype=np.uint8,offset=offset),count=width * height)
+        snapshot.wallsGrid = walls.astype(bool).reshape((height,width))
+        return snapshot
+
+
+class SnapshotRing():
+    """
+    The last capacity snapshots of a game, one every interval epochs.
+
+    The oldest snapshots are dropped, so the memory stays bounded.
+    """
+    def __init__(self,capacity=30,interval=60):
+        self.interval = interval
+        self.snapshots = deque(maxlen=capacity)
+
+    def __len__(self):
+        return len(self.snapshots)
+
+    def clear(self):
+        self.snapshots.clear()
+
+    def record(self,state):
+        """
+        Take a snapshot if the last one is at least interval epochs old
+        """
+        if len(self.snapshots) > 0 and state.epoch - self.snapshots[-1].epoch < self.interval:
+            return
+        self.snapshots.append(Snapshot(state))
+
+    def rewind(self,state,epochCount):
+        """
+        Restore the last snapshot at least epochCount epochs old (or the oldest
+        one), and drop the newer ones. Returns false if there is no snapshot.
+        """
+        if len(self.snapshots) == 0:
+            return False
+        epoch = state.epoch - epochCount
+        while len(self.snapshots) > 1 and self.snapshots[-1].epoch > epoch:
+            self.snapshots.pop()
+        self.snapshots[-1].restore(state)
+        return True
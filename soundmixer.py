@@ -0,0 +1,87 @@
+import pygame
+
+
+class SoundMixer():
+    """
+    Sounds played on a bounded pool of voices (reserved mixer channels).
+
+    play() only collects requests: identical requests (same sound in the same
+    cell) are merged, and flush() plays them, the closest to the listener
+    first. Each sound has a maximum number of voices. When there is no voice
+    left, a request takes the voice of the farthest sound being played, if it
+    is closer. The volume decreases with the distance, and sounds beyond
+    hearingDistance cells are not played.
+    """
+    def __init__(self,voiceCount=8,hearingDistance=16):
+        if pygame.mixer.get_num_channels() < voiceCount:
+            pygame.mixer.set_num_channels(voiceCount)
+        pygame.mixer.set_reserved(voiceCount)
+        self.voices = [ pygame.mixer.Channel(index) for index in range(voiceCount) ]
+        self.voiceDistances = [ 0 ] * voiceCount
+        self.hearingDistance = hearingDistance
+        self.sounds = { }
+        self.requests = { }
+
+    def addSound(self,name,sound,maxVoices=2):
+        self.sounds[name] = (sound,maxVoices)
+
+    def play(self,name,position=None):
+        """
+        Request a sound, at a world position (or None for a sound without position)
+        """
+        if position is None:
+            key = (name,None,None)
+        else:
+            key = (name,int(position.x),int(position.y))
+        if key not in self.requests:
+            self.requests[key] = position
+
+    def findVoice(self,sound,maxVoices,distance):
+        """
+        Returns the index of the voice to play a sound, or None
+        """
+        busy = [ voice.get_busy() for voice in self.voices ]
+        playing = [ index for index, voice in enumerate(self.voices) if busy[index] and voice.get_sound() is sound ]
+        if len(playing) >= maxVoices:
+            candidates = playing
+        else:
+            for index, isBusy in enumerate(busy):
+                if not isBusy:
+                    return index
+            candidates = range(len(self.voices))
+        index = max(candidates,key=lambda index: self.voiceDistances[index])
+        if self.voiceDistances[index] <= distance:
+            return None
+        return index
+
+    def flush(self,listenerPosition=None):
+        """
+        Play the requested sounds, heard from a world position
+        """
+        if len(self.requests) == 0:
+            return
+        requests = [ ]
+        for (name, x, y), position in self.requests.items():
+            if position is None or listenerPosition is None:
+                distance = 0
+            else:
+                distance = position.distance_to(listenerPosition)
+            if distance < self.hearingDistance:
+                requests.append((distance,name))
+        self.requests.clear()
+
+        requests.sort(key=lambda request: request[0])
+        for distance, name in requests:
+            sound, maxVoices = self.sounds[name]
+            index = self.findVoice(sound,maxVoices,distance)
+            if index is None:
+                continue
+            voice = self.voices[index]
+            voice.play(sound)
+            voice.set_volume(1 - distance / self.hearingDistance)
+            self.voiceDistances[index] = distance
+
+    def stop(self):
+        for voice in self.voices:
+            voice.stop()
+        self.requests.clear()
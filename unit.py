@@ -1,22 +1,60 @@
+from enum import IntEnum
 from pygame.math import Vector2
 
+class Status(IntEnum):
+    ALIVE = 0
+    DESTROYED = 1
+
 class GameItem():
+    """
+    Base of units and bullets.
+    
+    Items have no attribute dictionary (see __slots__). The position is a Vector2, 
+    and the integer coordinates of its cell are kept in cellX and cellY: they 
+    must be updated with the position (see GameState.moveUnit).
+    """
+    __slots__ = ('state','status','position','cellX','cellY','tile','orientation')
+    
     def __init__(self,state,position,tile):
         self.state = state
-        self.status = "alive"
+        self.status = Status.ALIVE
         self.position = position
+        self.cellX = int(position.x)
+        self.cellY = int(position.y)
         self.tile = tile
         self.orientation = 0    
     
 class Unit(GameItem):
-    def __init__(self,state,position,tile):
+    """
+    Tank or tower. Only mobile units (tanks) can move.
+    """
+    __slots__ = ('weaponTarget','lastBulletEpoch','lastMoveEpoch','previousPosition','mobile')
+    
+    def __init__(self,state,position,tile,mobile=False):
         super().__init__(state,position,tile)
         self.weaponTarget = Vector2(0,0)
         self.lastBulletEpoch = -100
+        self.lastMoveEpoch = -100
+        self.previousPosition = position
+        self.mobile = mobile
+
+    def renderPosition(self,alpha):
+        """
+        Returns the position between the last two epochs, with alpha from 0 
+        (previous epoch) to 1 (current epoch)
+        """
+        if alpha >= 1 or self.lastMoveEpoch != self.state.epoch - 1:
+            return self.position
+        return self.previousPosition.lerp(self.position,alpha)
         
 class Bullet(GameItem):
+    """
+    A bullet fired by a unit, before it is added to the bullets array
+    """
+    __slots__ = ('unit','startPosition','endPosition')
+    
     def __init__(self,state,unit):
-        super().__init__(state,unit.position,Vector2(2,1))
+        super().__init__(state,Vector2(unit.position),Vector2(2,1))
         self.unit = unit
-        self.startPosition = unit.position
-        self.endPosition = unit.weaponTarget
\ No newline at end of file
+        self.startPosition = Vector2(unit.position)
+        self.endPosition = Vector2(unit.weaponTarget)
@@ -0,0 +1,149 @@
+import math
+import numpy as np
+
+
+def traverseCells(x0,y0,x1,y1):
+    """
+    Returns the cells crossed by the segment (x0,y0)-(x1,y1), in order.
+
+    When the segment goes exactly through a cell corner, both cells beside the
+    corner are also returned.
+    """
+    cellX = math.floor(x0)
+    cellY = math.floor(y0)
+    endX = math.floor(x1)
+    endY = math.floor(y1)
+    dx = x1 - x0
+    dy = y1 - y0
+    stepX = 1 if dx > 0 else -1
+    stepY = 1 if dy > 0 else -1
+    if dx != 0:
+        tDeltaX = abs(1 / dx)
+        tMaxX = ((cellX + 1 - x0) if dx > 0 else (x0 - cellX)) * tDeltaX
+    else:
+        tDeltaX = tMaxX = math.inf
+    if dy != 0:
+        tDeltaY = abs(1 / dy)
+        tMaxY = ((cellY + 1 - y0) if dy > 0 else (y0 - cellY)) * tDeltaY
+    else:
+        tDeltaY = tMaxY = math.inf
+
+    cells = [ (cellX,cellY) ]
+    for _ in range(abs(endX - cellX) + abs(endY - cellY)):
+        if cellX == endX and cellY == endY:
+            break
+        if math.isclose(tMaxX,tMaxY):
+            cells.append((cellX + stepX,cellY))
+            cells.append((cellX,cellY + stepY))
+            cellX += stepX
+            cellY += stepY
+            tMaxX += tDeltaX
+            tMaxY += tDeltaY
+        elif tMaxX < tMaxY:
+            cellX += stepX
+            tMaxX += tDeltaX
+        else:
+            cellY += stepY
+            tMaxY += tDeltaY
+        cells.append((cellX,cellY))
+    return cells
+
+
+class Visibility():
+    """
+    Line of sight between cells, blocked by walls.
+
+    A cell is seen from another one if the segment between their centers does
+    not cross any wall cell, and if it is within bulletRange: this is the path
+    of a bullet. The cells crossed by the segment only depend on the offset
+    between the two cells, so they are computed once for all offsets in range.
+
+    For static units (towers), visible cells are precomputed at level loading
+    in a boolean table, and lookups are O(1). Other units use the offsets paths.
+    """
+    def __init__(self,state):
+        self.state = state
+        self.range = None
+        self.radius = 0
+        self.paths = { }
+        self.wallsGrid = None
+        self.towerRows = { }
+        self.towerTable = None
+
+    def rebuild(self):
+        """
+        Compute the visibility table of all static units
+        """
+        state = self.state
+        self.range = state.bulletRange
+        self.wallsGrid = state.wallsGrid
+        radius = int(math.floor(self.range))
+        self.radius = radius
+
+        # Cells between the two ends, for all offsets in range
+        self.paths = { }
+        for dy in range(-radius,radius + 1):
+            for dx in range(-radius,radius + 1):
+                if dx * dx + dy * dy > self.range * self.range:
+                    continue
+                cells = traverseCells(0.5,0.5,dx + 0.5,dy + 0.5)[1:]
+                cells = [ cell for cell in cells if cell != (dx,dy) ]
+                self.paths[(dx,dy)] = (
+                    np.array([ cell[0] for cell in cells ],dtype=np.int32),
+                    np.array([ cell[1] for cell in cells ],dtype=np.int32)
+                )
+
+        # Visible offsets for all static units at once
+        towers = [ unit for unit in state.units if not unit.mobile ]
+        self.towerRows = { unit: row for row, unit in enumerate(towers) }
+        size = 2 * radius + 1
+        self.towerTable = np.zeros((len(towers),size,size),dtype=bool)
+        towersX = np.array([ unit.cellX for unit in towers ],dtype=np.int32)
+        towersY = np.array([ unit.cellY for unit in towers ],dtype=np.int32)
+        height, width = self.wallsGrid.shape
+        for (dx,dy), (pathX,pathY) in self.paths.items():
+            targetX = towersX + dx
+            targetY = towersY + dy
+            visible = (targetX >= 0) & (targetX < width) & (targetY >= 0) & (targetY < height)
+            for offsetX, offsetY in zip(pathX,pathY):
+                cellX = np.clip(towersX + offsetX,0,width - 1)
+                cellY = np.clip(towersY + offsetY,0,height - 1)
+                visible &= ~self.wallsGrid[cellY,cellX]
+            self.towerTable[:,dy + radius,dx + radius] = visible
+
+    def isUpToDate(self):
+        """
+        Returns false if the walls or the bullet range changed since the last rebuild
+        """
+        return self.range == self.state.bulletRange and self.wallsGrid is self.state.wallsGrid
+
+    def canSee(self,unit,x,y):
+        """
+        Returns true if the unit can see the cell (x,y), and the cell is in bullet range
+        """
+        if not self.isUpToDate():
+            self.rebuild()
+        row = self.towerRows.get(unit)
+        if row is not None:
+            dx = x - unit.cellX
+            dy = y - unit.cellY
+            radius = self.radius
+            if dx < -radius or dx > radius or dy < -radius or dy > radius:
+                return False
+            return bool(self.towerTable[row,dy + radius,dx + radius])
+        return self.lineOfSight(unit.cellX,unit.cellY,x,y)
+
+    def lineOfSight(self,x0,y0,x1,y1):
+        """
+        Returns true if the cell (x1,y1) is seen from (x0,y0), and is in bullet range
+        """
+        if not self.isUpToDate():
+            self.rebuild()
+        height, width = self.wallsGrid.shape
+        if x1 < 0 or x1 >= width or y1 < 0 or y1 >= height:
+            return False
+        path = self.paths.get((x1 - x0,y1 - y0))
+        if path is None:
+            return False
+        pathX, pathY = path
+        return not self.wallsGrid[pathY + y0,pathX + x0].any()